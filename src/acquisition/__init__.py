@@ -1,8 +1,22 @@
 from .pipeline import *
+from .dumps import *
+from .ingest import *
+from .archive import *
 
 __all__ = (
     "pipeline",
     "download_matches",
+    "ingest_seasons",
+    "backfill_matches",
+    "pending_years",
+    "checkpointed_ingest",
+    "read_dumps",
+    "ResponseArchive",
+    "bulk_ingest",
+    "download_rows",
+    "read_dump_rows",
+    "sync_matches",
+    "find_stale_groups",
     "clean_download_list",
     "get_current_groups_matches"
 )
\ No newline at end of file
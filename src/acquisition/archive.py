@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import time
+import zlib
+from dataclasses import dataclass, asdict
+from typing import List, Optional, Generator, Tuple, Any, Dict, Iterable
+
+
+__all__ = (
+    "ResponseArchive",
+    "ArchiveFrame",
+)
+
+
+@dataclass(frozen=True)
+class ArchiveFrame:
+    league: str
+    year: int
+    fetched_at: float
+    digest: str
+    offset: int
+    length: int
+
+
+class ResponseArchive:
+    """Append-only archive of raw response bodies
+
+    The archive is a single file of frames, one per (league, year, fetch time).
+    Each frame is a json header line followed by the zlib compressed body, the
+    header containing everything needed to index the frame. The index is kept in
+    a json lines file next to the archive, it is rebuilt from the frame headers
+    if it is missing.
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.index_path = f"{path}.index"
+        self._frames: Optional[List[ArchiveFrame]] = None
+
+    def frames(self) -> List[ArchiveFrame]:
+        """Get all frames of the archive, in the order they were appended"""
+        if self._frames is None:
+            if os.path.exists(self.index_path):
+                with open(self.index_path) as fp:
+                    self._frames = [ArchiveFrame(**json.loads(line)) for line in fp if line.strip()]
+            else:
+                self._frames = list(self._scan())
+        return self._frames
+
+    def _scan(self) -> Generator[ArchiveFrame, None, None]:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as fp:
+            while True:
+                header = fp.readline()
+                if not header:
+                    break
+                meta = json.loads(header)
+                frame = ArchiveFrame(**meta, offset=fp.tell())
+                fp.seek(frame.length, os.SEEK_CUR)
+                yield frame
+
+    def append(self, league: str, year: int, body: bytes, fetched_at: Optional[float] = None) -> Optional[ArchiveFrame]:
+        """Append a response body to the archive
+
+        Bodies equal to the latest one archived for the same league and year are skipped.
+
+        :param league: key of the league of the response
+        :param year: year of the season of the response
+        :param body: raw response body
+        :param fetched_at: time of the fetch (default value = None, i.e. now)
+        :return: the new frame or None if the body was skipped
+
+        """
+        digest = hashlib.sha1(body).hexdigest()
+        latest = self.latest_frames(league).get(year)
+        if latest is not None and latest.digest == digest:
+            return None
+
+        frames = self.frames()
+        content = zlib.compress(body)
+        meta = {"league": league, "year": year, "fetched_at": fetched_at or time.time(), "digest": digest, "length": len(content)}
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, "ab") as fp:
+            fp.write(json.dumps(meta).encode() + b"\n")
+            frame = ArchiveFrame(**meta, offset=fp.tell())  # type: ignore
+            fp.write(content)
+        with open(self.index_path, "a") as fp:
+            fp.write(json.dumps(asdict(frame)) + "\n")
+        frames.append(frame)
+        return frame
+
+    def read(self, frames: Iterable[ArchiveFrame]) -> Generator[Tuple[ArchiveFrame, bytes], None, None]:
+        """Read the bodies of the given frames
+
+        :param frames: frames to read, preferably in the order they are stored in
+
+        """
+        with open(self.path, "rb") as fp:
+            for frame in frames:
+                fp.seek(frame.offset)
+                yield frame, zlib.decompress(fp.read(frame.length))
+
+    def latest_frames(self, league: Optional[str] = None) -> Dict[int, ArchiveFrame]:
+        """Get the latest frame of every season of a league
+
+        :param league: key of the league (default value = None)
+        :return: the frames by year
+
+        """
+        latest: Dict[int, ArchiveFrame] = {}
+        for frame in self.frames():
+            if frame.league == (league or "bl1") and (frame.year not in latest or frame.fetched_at >= latest[frame.year].fetched_at):
+                latest[frame.year] = frame
+        return latest
+
+    def replay(self, league: Optional[str] = None, years: Optional[Iterable[int]] = None) -> Generator[Tuple[int, Any], None, None]:
+        """Replay the latest archived data of every season of a league
+
+        :param league: key of the league to replay (default value = None)
+        :param years: seasons to replay (default value = None, i.e. all archived seasons)
+        :return: pairs of year and raw match data, just like `_download_matches`
+
+        """
+        latest = self.latest_frames(league)
+        if years is not None:
+            years = set(years)
+            latest = {year: frame for year, frame in latest.items() if year in years}
+        if not latest:
+            return
+        for frame, body in self.read(sorted(latest.values(), key=lambda frame: frame.offset)):
+            yield frame.year, json.loads(body)
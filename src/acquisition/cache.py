@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+
+__all__ = (
+    "ResponseCache",
+    "CacheEntry",
+)
+
+
+@dataclass(frozen=True)
+class CacheEntry:
+    url: str
+    body: bytes
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched_at: float
+
+    def is_fresh(self, ttl: Optional[float]) -> bool:
+        """Check whether the entry may be used without revalidation
+
+        :param ttl: maximum age of the entry in seconds, None means it always has to be revalidated
+
+        """
+        return ttl is not None and time.time() - self.fetched_at < ttl
+
+    @property
+    def validators(self) -> Dict[str, str]:
+        """Request headers to revalidate this entry with"""
+        headers = {}
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """On disk cache of response bodies and their validators
+
+    Each url is stored as a pair of files named after the hash of the url,
+    a small json file with the validators and the gzipped body.
+    """
+    def __init__(self, directory: str) -> None:
+        self._directory = directory
+
+    def _path(self, url: str, suffix: str) -> str:
+        return os.path.join(self._directory, hashlib.sha1(url.encode()).hexdigest() + suffix)
+
+    def get(self, url: str) -> Optional[CacheEntry]:
+        """Get the cached entry of a url
+
+        :param url: url to look up
+        :returns: the entry or None if the url isn't cached
+
+        """
+        try:
+            with open(self._path(url, ".json")) as fp:
+                meta = json.load(fp)
+            with gzip.open(self._path(url, ".gz")) as fp:
+                body = fp.read()
+        except (OSError, ValueError):
+            return None
+        return CacheEntry(url, body, meta["etag"], meta["last_modified"], meta["fetched_at"])
+
+    def store(self, url: str, body: bytes, headers: Dict[str, str]) -> CacheEntry:
+        """Store a response
+
+        :param url: url of the response
+        :param body: body of the response
+        :param headers: response headers, with lowercase keys
+
+        """
+        entry = CacheEntry(url, body, headers.get("etag"), headers.get("last-modified"), time.time())
+        os.makedirs(self._directory, exist_ok=True)
+        self._write(self._path(url, ".gz"), gzip.compress(body))
+        self._write_meta(entry)
+        return entry
+
+    def touch(self, entry: CacheEntry) -> CacheEntry:
+        """Mark an entry as just revalidated
+
+        :param entry: the entry to mark
+
+        """
+        entry = CacheEntry(entry.url, entry.body, entry.etag, entry.last_modified, time.time())
+        self._write_meta(entry)
+        return entry
+
+    def clear(self) -> None:
+        """Remove all cached entries"""
+        if os.path.isdir(self._directory):
+            for file_name in os.listdir(self._directory):
+                os.remove(os.path.join(self._directory, file_name))
+
+    def _write_meta(self, entry: CacheEntry) -> None:
+        self._write(self._path(entry.url, ".json"), json.dumps({
+            "url": entry.url,
+            "etag": entry.etag,
+            "last_modified": entry.last_modified,
+            "fetched_at": entry.fetched_at,
+        }).encode())
+
+    @staticmethod
+    def _write(path: str, content: bytes) -> None:
+        # write to a temporary file first, so concurrent readers never see partial files
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as fp:
+            fp.write(content)
+        os.replace(tmp_path, path)
@@ -1,10 +1,16 @@
 from __future__ import annotations
 
 from abc import ABCMeta, abstractmethod
-from typing import Dict, TypeVar, Optional, Generic, Type, Any, Generator, Callable
+from contextlib import contextmanager, nullcontext
+from itertools import count
+from typing import Dict, TypeVar, Optional, Generic, Type, Any, Generator, Callable, Tuple, Sequence, List, ContextManager
 
+import numpy as np
+from sqlalchemy.engine.base import Engine
 from sqlalchemy.orm import Session
 
+from .profiling import Profiler
+
 
 __all__ = (
     "Pipeline",
@@ -18,6 +24,10 @@ M = TypeVar("M", covariant=True)
 class Pipeline(Generic[M]):
     def __init__(self, transformations: Optional[Dict[Type[M], Dict[str, Transformation]]] = None) -> None:  # noqa: F821
         self._transformations = transformations or {}
+        self._identity_session: Optional[Session] = None
+        self._identity_map: Dict[Tuple[Type[M], Tuple[str, ...]], Dict[Tuple[Any, ...], M]] = {}
+        self._compiled: Dict[Type[M], Callable[[Any, Session], M]] = {}
+        self.profiler: Optional[Profiler] = None
 
     def add_transformation(self, model: Type[M], transformations: Dict[str, Transformation]) -> None:  # noqa: F821
         """Add a transformation map for a given model
@@ -27,18 +37,107 @@ class Pipeline(Generic[M]):
 
         """
         self._transformations[model] = transformations
+        self._compiled.pop(model, None)
+
+    def get_transformations(self, model: Type[M]) -> Dict[str, Transformation]:  # noqa: F821
+        """Get the transformation map of a given model
+
+        :param model: model to get the transformation map of
+
+        """
+        return self._transformations[model]
+
+    @contextmanager
+    def profile(self, engine: Optional[Engine] = None) -> Generator[Profiler, None, None]:
+        """Profile the pipeline within the enclosed block
+
+        While profiling, instances are created by the interpreted transformation
+        maps, so each model, field and transformation can be measured on its own.
+
+        :param engine: engine to count the DB round trips of (default: None)
+
+        """
+        self.profiler = profiler = Profiler()
+        if engine is not None:
+            profiler.attach(engine)
+        try:
+            yield profiler
+        finally:
+            profiler.detach()
+            self.profiler = None
+
+    def measure(self, label: str) -> ContextManager[None]:
+        """Measure the enclosed block if the pipeline is being profiled
+
+        :param label: label of the measurement
+
+        """
+        return self.profiler.measure(label) if self.profiler is not None else nullcontext()
+
+    def compile(self, model: Type[M]) -> Callable[[Any, Session], M]:
+        """Compile the transformation map of a given model into a single function
+
+        The generated function evaluates all fields in one flat body, chains which
+        are shared between fields, i.e. equal prefixes, are evaluated only once.
+        Transformations without an emitter are called as they are.
+
+        :param model: model to compile the transformation map for
+        :return: function creating an instance of the model from (data, session)
+
+        """
+        codegen = _CodeGen(self)
+        values = {
+            key: codegen.chain(transformation.steps, "data")
+            for key, transformation in self._transformations[model].items()
+        }
+        codegen.emit(f"return {codegen.const(model)}({', '.join(f'{key}={value}' for key, value in values.items())})")
+        self._compiled[model] = compiled = codegen.build(f"create_{model.__name__}")
+        return compiled
 
     def create(self, model: Type[M], data: Any, session: Session) -> M:
         """Create a single instance of a given model based on the given data
 
+        The transformation map of the model is compiled on first use.
+
         :param model: target model
         :param data: data to use in creation process
         :param session: DB session to use for queries
 
         """
-        return model(  # type: ignore
-            **self.generate_kwargs(model, data, session)
-        )
+        if self.profiler is not None:
+            with self.profiler.measure(model.__name__):
+                return model(**self.generate_kwargs(model, data, session))  # type: ignore
+
+        compiled = self._compiled.get(model)
+        if compiled is None:
+            compiled = self.compile(model)
+        return compiled(data, session)
+
+    def create_columns(self, model: Type[M], data: Any, session: Optional[Session] = None) -> Dict[str, np.ndarray]:
+        """Evaluate the transformation map of a given model on whole columns
+
+        Instead of one row at a time, every transformation is applied to all rows
+        at once, see `Transformation.apply_columns`. Chains which are shared between
+        fields, i.e. equal prefixes, are evaluated only once.
+
+        :param model: target model
+        :param data: rows to use in creation process
+        :param session: DB session to use for queries (default: None)
+        :return: one column per field, ready to be inserted
+
+        """
+        column = _as_column(data)
+        shared: Dict[Tuple[Any, ...], np.ndarray] = {}
+        columns = {}
+        for field, transformation in self._transformations[model].items():
+            result, key = column, ()
+            for step in transformation.steps:
+                key += (step.key,)
+                if key not in shared:
+                    shared[key] = step.apply_columns(self, result, session)
+                result = shared[key]
+            columns[field] = result
+        return columns
 
     def generate_kwargs(self, model: Type[M], data: Any, session: Session) -> Dict[str, Any]:
         """Generate required kwargs for model instantiation based on the given data
@@ -49,6 +148,11 @@ class Pipeline(Generic[M]):
         :param session: DB session to use for queries
 
         """
+        if self.profiler is not None:
+            return {
+                key: self.generate_kwarg(model, key, data, session)
+                for key in self._transformations[model]
+            }
         return {
             key: transformation(self, data, session)
             for key, transformation in self._transformations[model].items()
@@ -64,20 +168,101 @@ class Pipeline(Generic[M]):
         :param session: DB session to use for queries
 
         """
-        return self._transformations[model][key](self, data, session)
+        with self.measure(f"{model.__name__}.{key}"):
+            return self._transformations[model][key](self, data, session)
+
+    def reset_identity_map(self) -> None:
+        """Forget all instances remembered by the identity map
+
+        This should be called at the start of each run, i.e. whenever the
+        contents of the DB might have changed behind the pipelines back.
+
+        """
+        self._identity_session = None
+        self._identity_map = {}
+
+    def get_identity_map(self, model: Type[M], match_targets: Sequence[str], session: Session) -> Dict[Tuple[Any, ...], M]:
+        """Get the identity map of a given model for the current run
+
+        The identity map maps the values of the match targets onto the
+        corresponding instances. On first access it is pre-warmed with
+        a single bulk query for all existing instances of the model. As the
+        remembered instances are bound to a session, the whole identity map is
+        reset as soon as a different session is used.
+
+        :param model: model to get the identity map for
+        :param match_targets: fields which make up the key of the identity map
+        :param session: DB session to use for queries
+
+        """
+        if session is not self._identity_session:
+            self.reset_identity_map()
+            self._identity_session = session
+
+        map_key = (model, tuple(match_targets))
+        if map_key not in self._identity_map:
+            self._identity_map[map_key] = {
+                tuple(getattr(instance, key) for key in match_targets): instance
+                for instance in session.query(model)
+            }
+        return self._identity_map[map_key]
 
-    def create_multiple(self, model: Type[M], data: Any, session: Session) -> Generator[M, None, None]:
+    def create_multiple(self, model: Type[M], data: Any, session: Session, batch_size: Optional[int] = None) -> Generator[M, None, None]:
         """Create multiple instances of a given model based on the given data
 
+        If a batch size is given, the instances are added to the session and
+        committed in chunks of that size, the last chunk being committed once
+        the data is exhausted. Committed instances are expunged from the session
+        afterwards, thus they must not be used after the next instance was requested.
+
         :param model: target model
         :param data: data to use in creation process
         :param session: DB session to use for queries
+        :param batch_size: number of instances to commit at once (default: None)
 
         """
-        return (
-            self.create(model, row, session)
-            for row in data
-        )
+        if batch_size is None:
+            return (
+                self.create(model, row, session)
+                for row in data
+            )
+        else:
+            return self._create_batched(model, data, session, batch_size)
+
+    def _create_batched(self, model: Type[M], data: Any, session: Session, batch_size: int) -> Generator[M, None, None]:
+        pending = 0
+        for row in data:
+            instance = self.create(model, row, session)
+            session.add(instance)
+            yield instance
+            pending += 1
+            if pending >= batch_size:
+                self.commit(session)
+                pending = 0
+        if pending > 0:
+            self.commit(session)
+
+    def commit(self, session: Session) -> None:
+        """Commit all pending instances and expunge them from the session
+
+        Instances remembered by the identity map stay in the session, as they
+        will most likely be referenced again by later instances.
+
+        :param session: DB session to commit
+
+        """
+        persisted = list(session.new)
+        with self.measure("commit"):
+            session.commit()
+
+        retained = {
+            id(instance)
+            for identity_map in self._identity_map.values()
+            for instance in identity_map.values()
+        }
+        for instance in persisted:
+            if id(instance) not in retained:
+                session.expunge(instance)
 
 
 class Transformation(metaclass=ABCMeta):
@@ -85,23 +270,103 @@ class Transformation(metaclass=ABCMeta):
     A transformation represents a single function or
     chain thereof with the sole purpose to transform/"munge" data.
     """
+    emit_step: Optional[Callable[..., str]] = None
+    column_step: Optional[Callable[..., np.ndarray]] = None
+
     def __init__(self, *args, **kwargs) -> None:
-        # this 'cast' to a list from the normal tuple is done to support the
-        # _CONCAT transformation type
-        self._args = list(args)
+        self._args = args
         self._kwargs = kwargs
 
     def __call__(self, pipeline: Pipeline, data: Any, session: Session) -> Any:
+        if pipeline.profiler is not None and not isinstance(self, _CONCAT):
+            with pipeline.profiler.measure(repr(self)):
+                return self.apply(pipeline, data, session, *self._args, **self._kwargs)
         return self.apply(pipeline, data, session, *self._args, **self._kwargs)
 
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({', '.join([_describe(arg) for arg in self._args] + [f'{name}={_describe(arg)}' for name, arg in self._kwargs.items()])})"
+
     def __or__(self, other: Transformation) -> Transformation:  # noqa: F821
         if not isinstance(other, Transformation):
             raise TypeError("Can only chain Transformations with Transformations.")
-        if isinstance(self, _CONCAT):
-            self._args.append(other)
-            return self
+        # a new chain is created every time, so a chain can be shared as the common
+        # prefix of multiple other chains
+        return _CONCAT(*self.steps, *other.steps)
+
+    @property
+    def steps(self) -> Tuple[Transformation, ...]:  # noqa: F821
+        """The chain of single transformations this transformation consists of"""
+        return (self,)
+
+    @property
+    def key(self) -> Tuple[Any, ...]:
+        """Structural key of the transformation
+
+        Two transformations with the same key produce the same results, arguments
+        which aren't plain values, i.e. functions, are compared by identity.
+
+        """
+        return (
+            type(self),
+            tuple(_key(arg) for arg in self._args),
+            tuple(sorted((name, _key(arg)) for name, arg in self._kwargs.items())),
+        )
+
+    def emit(self, codegen: _CodeGen, src: str) -> str:  # noqa: F821
+        """Emit the code applying this transformation in a compiled pipeline
+
+        :param codegen: code generator to emit the code with
+        :param src: expression of the input data
+        :return: expression of the result
+
+        """
+        if self.emit_step is None:
+            return codegen.assign(f"{codegen.const(self)}(pipeline, {src}, session)")
+        else:
+            return self.emit_step(codegen, src, *self._args, **self._kwargs)
+
+    @classmethod
+    def emitter(cls, func: Callable[..., str]) -> Callable[..., str]:
+        """Decorator, which registers a function to inline a transformation in compiled pipelines.
+
+        The function receives the code generator, the expression of the input data
+        and the arguments of the transformation, and returns the expression of the result.
+
+        :param func: function to be registered
+
+        """
+        cls.emit_step = staticmethod(func)
+        return func
+
+    def apply_columns(self, pipeline: Pipeline, column: np.ndarray, session: Optional[Session]) -> np.ndarray:
+        """Apply this transformation to a whole column of data at once
+
+        Transformations without a column-wise implementation are applied row by row.
+
+        :param pipeline: parent pipeline
+        :param column: one dimensional object array of the target data
+        :param session: DB session to interact with
+        :return: one dimensional object array of the results
+
+        """
+        if self.column_step is None:
+            return _map_column(lambda data: self(pipeline, data, session), column)
         else:
-            return _CONCAT(self, other)
+            return self.column_step(pipeline, column, session, *self._args, **self._kwargs)
+
+    @classmethod
+    def columnar(cls, func: Callable[..., np.ndarray]) -> Callable[..., np.ndarray]:
+        """Decorator, which registers a column-wise implementation of a transformation.
+
+        The function receives the pipeline, a one dimensional object array of the input
+        data, the session and the arguments of the transformation, and returns an
+        object array of the results of the same length.
+
+        :param func: function to be registered
+
+        """
+        cls.column_step = staticmethod(func)
+        return func
 
     @staticmethod
     @abstractmethod
@@ -134,14 +399,123 @@ class Transformation(metaclass=ABCMeta):
         return new_type
 
 
-@Transformation.from_func
-def _CONCAT(pipeline: Pipeline, data: Any, session: Session, *transformations: Transformation) -> Any:
-    """A simple transformation that represent the concatenation between two or more other transformations.
+class _CONCAT(Transformation):
+    """A simple transformation that represent the concatenation between two or more other transformations."""
+    @staticmethod
+    def apply(pipeline: Pipeline, data: Any, session: Session, *transformations: Transformation) -> Any:
+        """Apply the concatenated transformations one after another
 
-    :param *transformations: transformation to concatenate
+        :param *transformations: transformation to concatenate
 
-    """
-    res = data
-    for transformation in transformations:
-        res = transformation(pipeline, res, session)
-    return res
+        """
+        res = data
+        for transformation in transformations:
+            res = transformation(pipeline, res, session)
+        return res
+
+    @property
+    def steps(self) -> Tuple[Transformation, ...]:
+        return self._args
+
+    def __repr__(self) -> str:
+        return " | ".join(map(repr, self._args))
+
+    def apply_columns(self, pipeline: Pipeline, column: np.ndarray, session: Optional[Session]) -> np.ndarray:
+        for transformation in self._args:
+            column = transformation.apply_columns(pipeline, column, session)
+        return column
+
+    def emit(self, codegen: _CodeGen, src: str) -> str:
+        return codegen.chain(self._args, src)
+
+
+def _as_column(data: Any) -> np.ndarray:
+    # build the array element by element, so nested sequences stay single elements
+    if isinstance(data, np.ndarray) and data.dtype == object and data.ndim == 1:
+        return data
+    data = list(data)
+    column = np.empty(len(data), dtype=object)
+    for i, value in enumerate(data):
+        column[i] = value
+    return column
+
+
+def _map_column(func: Callable[[Any], Any], column: np.ndarray) -> np.ndarray:
+    if len(column) == 0:
+        return np.empty(0, dtype=object)
+    return np.frompyfunc(func, 1, 1)(column)
+
+
+def _describe(arg: Any) -> str:
+    if not isinstance(arg, Transformation) and hasattr(arg, "__name__"):
+        return arg.__name__
+    return repr(arg)
+
+
+def _key(arg: Any) -> Any:
+    if isinstance(arg, Transformation):
+        return arg.key
+    elif isinstance(arg, (list, tuple)):
+        return tuple(_key(item) for item in arg)
+    elif arg is None or isinstance(arg, (str, int, float, bool)):
+        return arg
+    else:
+        return ("id", id(arg))
+
+
+class _CodeGen:
+    """Code generator used to compile the transformation maps of a pipeline"""
+    def __init__(self, pipeline: Pipeline) -> None:
+        self.namespace: Dict[str, Any] = {"pipeline": pipeline}
+        self.lines: List[str] = []
+        self._indent = 1
+        self._counter = count()
+        self._shared: Dict[Tuple[Any, ...], str] = {}
+
+    def emit(self, line: str) -> None:
+        self.lines.append("    " * self._indent + line)
+
+    @contextmanager
+    def block(self, header: str) -> Generator[None, None, None]:
+        self.emit(header)
+        self._indent += 1
+        yield
+        self._indent -= 1
+
+    def variable(self) -> str:
+        return f"_v{next(self._counter)}"
+
+    def assign(self, expr: str) -> str:
+        name = self.variable()
+        self.emit(f"{name} = {expr}")
+        return name
+
+    def const(self, value: Any) -> str:
+        if value is None or type(value) in (str, int, float, bool):
+            return repr(value)
+        name = f"_c{next(self._counter)}"
+        self.namespace[name] = value
+        return name
+
+    def chain(self, transformations: Sequence[Transformation], src: str) -> str:
+        """Emit a chain of transformations
+
+        Results of chains emitted at the top level are remembered, so an equal
+        chain or prefix thereof is only ever evaluated once.
+
+        """
+        key: Tuple[Any, ...] = (src,)
+        for transformation in transformations:
+            key += (transformation.key,)
+            if self._indent == 1 and key in self._shared:
+                src = self._shared[key]
+            else:
+                src = transformation.emit(self, src)
+                if self._indent == 1:
+                    self._shared[key] = src
+        return src
+
+    def build(self, name: str) -> Callable[[Any, Session], Any]:
+        source = "\n".join([f"def {name}(data, session):"] + self.lines)
+        exec(compile(source, f"<pipeline {name}>", "exec"), self.namespace)
+        return self.namespace[name]
@@ -0,0 +1,133 @@
+import bz2
+import gzip
+import json
+import lzma
+import os
+import re
+import tarfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, Executor, Future, wait, FIRST_COMPLETED
+from typing import List, Optional, Generator, Tuple, Any, Dict, Callable, Iterable, Set
+
+from dateutil.parser import parse as parse_datetime
+
+
+__all__ = (
+    "read_dumps",
+)
+
+
+_decompressors = {
+    ".gz": gzip.decompress,
+    ".bz2": bz2.decompress,
+    ".xz": lzma.decompress,
+}
+_archive_suffixes = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+
+
+def _is_dump(name: str) -> bool:
+    root, suffix = os.path.splitext(name.lower())
+    return suffix == ".json" or suffix in _decompressors and root.endswith(".json")
+
+
+def _collect_dumps(source: str) -> Generator[Tuple[str, Optional[bytes]], None, None]:
+    """Collect all dumps from a source
+
+    Plain files are read by the workers themselves, members of archives
+    are read here, as archives can't be shared between processes.
+
+    :param source: directory, archive or single dump
+
+    """
+    if os.path.isdir(source):
+        for directory, _, file_names in sorted(os.walk(source)):
+            for file_name in sorted(file_names):
+                if _is_dump(file_name):
+                    yield os.path.join(directory, file_name), None
+    elif source.lower().endswith(".zip"):
+        with zipfile.ZipFile(source) as archive:
+            for name in sorted(archive.namelist()):
+                if _is_dump(name):
+                    yield name, archive.read(name)
+    elif source.lower().endswith(_archive_suffixes):
+        with tarfile.open(source) as archive:
+            for member in archive:
+                if member.isfile() and _is_dump(member.name):
+                    yield member.name, archive.extractfile(member).read()  # type: ignore
+    else:
+        yield source, None
+
+
+def _season_year(name: str, data: List[Dict[str, Any]]) -> int:
+    """Determine the season of a dump
+
+    The year is taken from the file name if it contains one, otherwise from
+    the league name, e.g. "1. Fußball-Bundesliga 2016/2017", and as a last resort
+    from the date of the earliest match.
+
+    """
+    match = re.search(r"(?<!\d)(?:19|20)\d\d(?!\d)", os.path.basename(name))
+    if match is None and len(data) > 0:
+        match = re.search(r"((?:19|20)\d\d)/\d\d", data[0].get("LeagueName", ""))
+        if match is None:
+            return min(parse_datetime(row["MatchDateTime"]) for row in data).year
+        return int(match.group(1))
+    elif match is None:
+        raise ValueError(f"Couldn't determine the season of the empty dump {name}.")
+    return int(match.group(0))
+
+
+def _parse_dump(name: str, content: Optional[bytes]) -> Tuple[int, List[Dict[str, Any]]]:
+    if content is None:
+        with open(name, "rb") as fp:
+            content = fp.read()
+    suffix = os.path.splitext(name.lower())[1]
+    if suffix in _decompressors:
+        content = _decompressors[suffix](content)
+    data = json.loads(content)
+    return _season_year(name, data), data
+
+
+def _bounded_map(executor: Executor, func: Callable[..., Any], items: Iterable[Tuple[Any, ...]], window: int) -> Generator[Any, None, None]:
+    """Run a function on items in an executor, yielding the results as they complete
+
+    At most `window` items are in flight at once, thus the items are read lazily,
+    while results are already consumed, and never all held in memory.
+
+    :param executor: executor to submit to
+    :param func: picklable function, called with the unpacked items
+    :param items: argument tuples of the calls
+    :param window: maximum number of submitted but not yet yielded calls
+
+    """
+    pending: Set[Future] = set()
+    for item in items:
+        pending.add(executor.submit(func, *item))
+        if len(pending) >= window:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+
+
+def read_dumps(source: str, workers: Optional[int] = None, parse: Callable[[str, Optional[bytes]], Any] = _parse_dump) -> Generator[Any, None, None]:
+    """Read raw getmatchdata dumps from local disk
+
+    Dumps are json files, which may be compressed via gzip, bz2 or xz. They
+    can be given as a single file, a directory or an archive (zip or tar).
+    Decompressing and parsing is done in parallel by a pool of worker processes,
+    the seasons are yielded as they are parsed.
+
+    :param source: path to a directory, archive or a single dump
+    :param workers: number of worker processes (default value = None, i.e. one per cpu)
+    :param parse: picklable function run by the workers, receiving the name and content
+                  of a dump, which is None for plain files (default value = _parse_dump)
+    :return: pairs of year and parsed data per dump, unless a different parse function is given
+
+    """
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from _bounded_map(executor, parse, _collect_dumps(source), 2 * workers)
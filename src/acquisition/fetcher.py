@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+from queue import Queue
+from threading import Thread, local
+from typing import Dict, List, Optional, Generator, Any, Iterable
+
+import requests
+
+from .cache import ResponseCache
+
+
+__all__ = (
+    "AsyncFetcher",
+    "FetchError",
+    "Response",
+)
+
+
+class FetchError(RuntimeError):
+    """Raised if a url couldn't be fetched successfully."""
+    def __init__(self, url: str, status: Optional[int] = None, reason: str = "") -> None:
+        super().__init__(f"Fetching {url} failed: {status or ''} {reason}".strip())
+        self.url = url
+        self.status = status
+
+
+@dataclass(frozen=True)
+class Response:
+    url: str
+    status: int
+    headers: Dict[str, str]
+    body: bytes
+    cached: bool = False
+    # the url originally asked for, which differs from `url` after redirects
+    requested_url: Optional[str] = None
+
+    def json(self) -> Any:
+        return json.loads(self.body)
+
+
+@dataclass
+class AsyncFetcher:
+    """Fetches multiple urls concurrently on an asyncio event loop
+
+    At most `concurrency` requests are in flight at once. They are sent by
+    `requests` sessions on a pool of as many threads, thus connections are kept
+    alive and reused per host, responses are requested gzip encoded and the
+    proxies and credentials of the environment (HTTP(S)_PROXY, NO_PROXY, .netrc)
+    are honoured. Failed requests, i.e. connection errors and 429/5xx responses,
+    are retried `retries` times with an exponential backoff starting at `backoff` seconds. Redirects are
+    followed up to `max_redirects` times, any other response than 200 fails.
+    If a cache is given, cached responses are revalidated via conditional requests,
+    or not requested at all as long as they are younger than the requested ttl.
+    """
+    concurrency: int = 4
+    retries: int = 3
+    backoff: float = .5
+    timeout: float = 30.
+    max_redirects: int = 5
+    headers: Dict[str, str] = field(default_factory=dict)
+    cache: Optional[ResponseCache] = None
+
+    _executor: Optional[ThreadPoolExecutor] = field(init=False, default=None)
+    _local: local = field(init=False, default_factory=local)
+    _sessions: List[requests.Session] = field(init=False, default_factory=list)
+
+    def get(self, url: str, ttl: Optional[float] = None) -> Response:
+        """Fetch a single url synchronously
+
+        :param url: url to fetch
+        :param ttl: maximum age in seconds of a cached response to use without revalidation (default: None)
+
+        """
+        (response,) = self.fetch_all([url], ttl=ttl)
+        return response
+
+    def fetch_all(self, urls: Iterable[str], headers: Optional[Dict[str, Dict[str, str]]] = None, ttl: Optional[float] = None) -> Generator[Response, None, None]:
+        """Fetch all given urls, yielding the responses as they complete
+
+        The event loop runs in a separate thread, thus this can be used from
+        synchronous code just like any other generator.
+
+        :param urls: urls to fetch
+        :param headers: additional request headers per url (default: None)
+        :param ttl: maximum age in seconds of a cached response to use without revalidation (default: None)
+
+        """
+        urls = list(urls)
+        results: Queue = Queue()
+        loop = asyncio.new_event_loop()
+
+        async def fetch_job(semaphore: asyncio.Semaphore, url: str) -> None:
+            async with semaphore:
+                try:
+                    results.put(await self.fetch(url, (headers or {}).get(url), ttl))
+                except Exception as e:
+                    results.put(e)
+
+        async def main() -> None:
+            semaphore = asyncio.Semaphore(self.concurrency)
+            try:
+                await asyncio.gather(*[fetch_job(semaphore, url) for url in urls])
+            finally:
+                self.close()
+
+        def run_loop() -> None:
+            try:
+                loop.run_until_complete(task)
+            except asyncio.CancelledError:
+                ...
+
+        task = loop.create_task(main())
+        thread = Thread(target=run_loop, daemon=True)
+        thread.start()
+        try:
+            for _ in urls:
+                result = results.get()
+                if isinstance(result, Exception):
+                    raise result
+                yield result
+        finally:
+            loop.call_soon_threadsafe(task.cancel)
+            thread.join()
+            loop.close()
+
+    async def fetch(self, url: str, headers: Optional[Dict[str, str]] = None, ttl: Optional[float] = None) -> Response:
+        """Fetch a single url, retrying on failure
+
+        :param url: url to fetch
+        :param headers: additional request headers (default: None)
+        :param ttl: maximum age in seconds of a cached response to use without revalidation (default: None)
+
+        """
+        entry = self.cache.get(url) if self.cache is not None else None
+        if entry is not None:
+            if entry.is_fresh(ttl):
+                return Response(url, 200, {}, entry.body, cached=True, requested_url=url)
+            headers = {**entry.validators, **(headers or {})}
+
+        for attempt in range(self.retries + 1):
+            try:
+                response = await asyncio.wait_for(self._request(url, headers or {}), self.timeout)
+            except (OSError, asyncio.TimeoutError) as e:
+                error = FetchError(url, reason=repr(e))
+            else:
+                if response.status == 304 and entry is not None:
+                    self.cache.touch(entry)  # type: ignore
+                    return Response(url, 304, response.headers, entry.body, cached=True, requested_url=url)
+                elif response.status == 200:
+                    if self.cache is not None:
+                        self.cache.store(url, response.body, response.headers)
+                    return replace(response, requested_url=url)
+                error = FetchError(url, response.status)
+                if response.status != 429 and response.status < 500:
+                    break
+            if attempt < self.retries:
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+        raise error
+
+    def close(self) -> None:
+        """Close the sessions and their idle connections"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        for session in self._sessions:
+            session.close()
+        self._sessions.clear()
+
+    async def _request(self, url: str, headers: Dict[str, str]) -> Response:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.concurrency)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._send, url, headers)
+
+    def _session(self) -> requests.Session:
+        # sessions aren't thread safe, thus every thread of the executor gets one of its own
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            session.headers.update({"Accept": "application/json", **self.headers})
+            session.max_redirects = self.max_redirects
+            self._sessions.append(session)
+        return session
+
+    def _send(self, url: str, headers: Dict[str, str]) -> Response:
+        try:
+            response = self._session().get(url, headers=headers, timeout=self.timeout)
+        except requests.TooManyRedirects as e:
+            raise FetchError(url, e.response.status_code if e.response is not None else None, f"more than {self.max_redirects} redirects")
+        return Response(response.url, response.status_code, {key.lower(): value for key, value in response.headers.items()}, response.content)
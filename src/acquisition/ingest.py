@@ -0,0 +1,276 @@
+from __future__ import annotations
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from queue import Queue, Empty
+from threading import Thread
+from typing import List, Optional, Generator, Tuple, Any, Iterable, NamedTuple, Set, Dict, Type, TypeVar
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.engine.base import Engine
+
+from ..db.models import Match, Team, Season, Group, MatchParticipation, team_season_association_table, matchday_key
+from ..db.cache import bump_generation
+from .core import Pipeline, _as_column
+from .pipeline import pipeline, _download_matches, response_cache
+from .dumps import read_dumps, _parse_dump, _bounded_map
+from .archive import ResponseArchive
+from .transformations import Get
+
+
+__all__ = (
+    "SeasonRows",
+    "season_rows",
+    "convert_seasons",
+    "download_rows",
+    "read_dump_rows",
+    "BulkWriter",
+    "bulk_ingest",
+)
+
+
+R = TypeVar("R", bound=NamedTuple)
+
+
+class TeamRow(NamedTuple):
+    id: int
+    name: str
+
+
+class GroupRow(NamedTuple):
+    id: int
+    order_id: int
+
+
+class MatchRow(NamedTuple):
+    id: int
+    date: datetime
+    is_finished: bool
+    group_id: int
+    host_team_id: int
+    guest_team_id: int
+    host_points: int
+    guest_points: int
+
+
+# plain row variant of the pipeline, i.e. without any DB interaction,
+# the fields are taken from the transformation maps of the models
+row_pipeline: Pipeline[NamedTuple] = Pipeline({
+    TeamRow: pipeline.get_transformations(Team),
+    GroupRow: pipeline.get_transformations(Group),
+    MatchRow: {
+        **{
+            key: transformation
+            for key, transformation in pipeline.get_transformations(Match).items()
+            if key in MatchRow._fields
+        },
+        "group_id": Get("Group") | pipeline.get_transformations(Group)["id"],
+        "host_team_id": Get("Team1") | pipeline.get_transformations(Team)["id"],
+        "guest_team_id": Get("Team2") | pipeline.get_transformations(Team)["id"],
+    },
+})
+
+
+@dataclass
+class SeasonRows:
+    """All rows of a single season, ready to be inserted"""
+    year: int
+    teams: List[TeamRow] = field(default_factory=list)
+    groups: List[GroupRow] = field(default_factory=list)
+    matches: List[MatchRow] = field(default_factory=list)
+    participations: List[Tuple[int, int, bool]] = field(default_factory=list)
+
+
+def _unique(columns: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    # keep the first occurrence of every id, in order of appearance
+    _, first = np.unique(columns["id"], return_index=True)
+    first.sort()
+    return {key: column[first] for key, column in columns.items()}
+
+
+def _to_rows(row_type: Type[R], columns: Dict[str, np.ndarray]) -> List[R]:
+    return list(map(row_type._make, zip(*(columns[key].tolist() for key in row_type._fields))))  # type: ignore
+
+
+def season_rows(year: int, data: List[Any]) -> SeasonRows:
+    """Turn the raw match data of a season into plain rows
+
+    The transformation maps are evaluated on the whole season at once,
+    see `Pipeline.create_columns`.
+
+    :param year: year of the season
+    :param data: raw match data of the season
+
+    """
+    column = _as_column(data)
+    matches = row_pipeline.create_columns(MatchRow, column)  # type: ignore
+    groups = row_pipeline.create_columns(GroupRow, Get("Group").apply_columns(row_pipeline, column, None))  # type: ignore
+    hosts, guests = (
+        row_pipeline.create_columns(TeamRow, Get(key).apply_columns(row_pipeline, column, None))  # type: ignore
+        for key in ("Team1", "Team2")
+    )
+    # interleave hosts and guests, i.e. order the teams by their appearance
+    teams = {key: np.stack([hosts[key], guests[key]], axis=1).ravel() for key in TeamRow._fields}
+
+    return SeasonRows(
+        year,
+        teams=_to_rows(TeamRow, _unique(teams)),
+        groups=_to_rows(GroupRow, _unique(groups)),
+        matches=_to_rows(MatchRow, matches),
+        participations=list(zip(
+            teams["id"].tolist(),
+            np.repeat(matches["id"], 2).tolist(),
+            np.tile([True, False], len(column)).tolist(),
+        )),
+    )
+
+
+def convert_seasons(seasons: Iterable[Tuple[int, List[Any]]], workers: Optional[int] = None) -> Generator[SeasonRows, None, None]:
+    """Convert raw seasons into rows in a pool of worker processes
+
+    :param seasons: pairs of year and raw match data of the season
+    :param workers: number of worker processes (default value = None, i.e. one per cpu)
+
+    """
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # the seasons are converted and yielded while later ones are still being downloaded
+        yield from _bounded_map(executor, season_rows, seasons, 2 * workers)
+
+
+def download_rows(
+    years: List[int], league: Optional[str] = None, concurrency: int = 4, use_cache: bool = True, workers: Optional[int] = None,
+    archive: Optional[ResponseArchive] = None
+) -> Generator[SeasonRows, None, None]:
+    """Download seasons and convert them into rows, see `download_matches` and `convert_seasons`
+
+    :param years: list of year to download matches of
+    :param league: key od league to download matches of (default value = None)
+    :param concurrency: maximum number of concurrent downloads (default value = 4)
+    :param use_cache: whether to use the response cache (default value = True)
+    :param workers: number of worker processes (default value = None, i.e. one per cpu)
+    :param archive: archive to append the raw responses to (default value = None)
+
+    """
+    seasons = _download_matches(years, league, concurrency, cache=response_cache if use_cache else None, archive=archive)
+    return convert_seasons(seasons, workers)
+
+
+def _parse_dump_rows(name: str, content: Optional[bytes]) -> SeasonRows:
+    return season_rows(*_parse_dump(name, content))
+
+
+def read_dump_rows(source: str, workers: Optional[int] = None) -> Generator[SeasonRows, None, None]:
+    """Read dumps and convert them into rows in the same worker processes, see `read_dumps`
+
+    :param source: path to a directory, archive or a single dump
+    :param workers: number of worker processes (default value = None, i.e. one per cpu)
+
+    """
+    return read_dumps(source, workers, parse=_parse_dump_rows)
+
+
+class BulkWriter(Thread):
+    """Thread inserting season rows into the DB
+
+    Every season is inserted via executemany statements in a single transaction.
+    Teams and groups which already exist are skipped, as are whole seasons.
+    Written (or skipped) seasons are put into the `written` queue as pairs of
+    the season rows and a flag whether they were skipped.
+    """
+    def __init__(self, engine: Engine, max_pending: int = 4) -> None:
+        super().__init__(daemon=True)
+        self._engine = engine
+        self.pending: Queue = Queue(maxsize=max_pending)
+        self.written: Queue = Queue()
+        self.error: Optional[BaseException] = None
+
+    def run(self) -> None:
+        try:
+            with self._engine.connect() as connection:
+                years = {year for (year,) in connection.execute(select([Season.year]))}
+                team_ids = {team_id for (team_id,) in connection.execute(select([Team.id]))}
+                group_ids = {group_id for (group_id,) in connection.execute(select([Group.id]))}
+
+                while True:
+                    rows = self.pending.get()
+                    if rows is None:
+                        break
+                    skipped = rows.year in years
+                    if not skipped:
+                        with connection.begin():
+                            self._write(connection, rows, team_ids, group_ids)
+                        years.add(rows.year)
+                    self.written.put((rows, skipped))
+        except BaseException as e:
+            self.error = e
+            # unblock the producer
+            while True:
+                try:
+                    self.pending.get_nowait()
+                except Empty:
+                    break
+
+    @staticmethod
+    def _write(connection: Any, rows: SeasonRows, team_ids: Set[int], group_ids: Set[int]) -> None:
+        season_id = connection.execute(Season.__table__.insert().values(year=rows.year)).inserted_primary_key[0]
+
+        new_teams = [team._asdict() for team in rows.teams if team.id not in team_ids]
+        if new_teams:
+            connection.execute(Team.__table__.insert(), new_teams)
+        connection.execute(team_season_association_table.insert(), [
+            {"season_id": season_id, "team_id": team.id} for team in rows.teams
+        ])
+
+        new_groups = [
+            {**group._asdict(), "season_id": season_id, "matchday_key": matchday_key(rows.year, group.order_id)}
+            for group in rows.groups if group.id not in group_ids
+        ]
+        if new_groups:
+            connection.execute(Group.__table__.insert(), new_groups)
+
+        if rows.matches:
+            connection.execute(Match.__table__.insert(), [match._asdict() for match in rows.matches])
+            connection.execute(MatchParticipation.__table__.insert(), [
+                {"team_id": team_id, "match_id": match_id, "hosted": hosted}
+                for team_id, match_id, hosted in rows.participations
+            ])
+
+        bump_generation(connection)
+
+        team_ids.update(team.id for team in rows.teams)
+        group_ids.update(group.id for group in rows.groups)
+
+
+def bulk_ingest(engine: Engine, rows: Iterable[SeasonRows]) -> Generator[Tuple[SeasonRows, bool], None, None]:
+    """Insert season rows via a single writer thread
+
+    The rows are handed to a BulkWriter as they are produced, thus producing
+    and writing overlap. Seasons which are already present are skipped.
+
+    :param engine: engine of the DB to write to
+    :param rows: rows of the seasons to insert
+    :return: pairs of the rows of the seasons and a flag whether they were skipped
+
+    """
+    writer = BulkWriter(engine)
+    writer.start()
+    try:
+        for season in rows:
+            if writer.error is not None:
+                break
+            writer.pending.put(season)
+            while not writer.written.empty():
+                yield writer.written.get()
+    finally:
+        if writer.error is None:
+            writer.pending.put(None)
+        writer.join()
+
+    while not writer.written.empty():
+        yield writer.written.get()
+    if writer.error is not None:
+        raise writer.error
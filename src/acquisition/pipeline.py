@@ -1,24 +1,46 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import List, Optional, Generator, cast, Tuple, Dict, Any
+import os
+from datetime import datetime
+from typing import List, Optional, Generator, cast, Tuple, Any, Dict, Iterable, TypeVar, Callable
 
 from dateutil.parser import parse as parse_datetime
-import requests
+from sqlalchemy import not_
 from sqlalchemy.orm import Session
 
 from ..db import Model
-from ..db.models import Match, Team, Season, Group, MatchParticipation
+from ..db.core import project_dir
+from ..db.models import Match, Team, Season, Group, MatchParticipation, IngestCheckpoint
 from .core import Pipeline
+from .fetcher import AsyncFetcher, Response
+from .cache import ResponseCache
+from .archive import ResponseArchive
 from .transformations import Get, Custom, Filter, GetOrCreate, CreateMultiple, If, Constant
 
 
 __all__ = (
     "pipeline",
     "download_matches",
+    "ingest_seasons",
+    "backfill_matches",
+    "pending_years",
+    "checkpointed_ingest",
+    "sync_matches",
+    "find_stale_groups",
     "clean_download_list",
     "get_current_groups_matches"
 )
 
 
+def _parse_datetime(value: str) -> datetime:
+    # openligadb sends ISO timestamps, which can be parsed way faster than by dateutil
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return parse_datetime(value)
+
+
+# shared between the point fields, so compiled pipelines only filter the results once
+final_results = Get("MatchResults") | Filter(lambda item: "end" in item["ResultName"].lower())
+
 pipeline: Pipeline[Model] = Pipeline({
     MatchParticipation: {
         "team": Get("Team") | GetOrCreate(Team, match_targets=["id"]),
@@ -39,19 +61,21 @@ pipeline: Pipeline[Model] = Pipeline({
     },
     Match: {
         "id": Get("MatchID"),
-        "date": Get("MatchDateTime") | Custom(lambda data: parse_datetime(data)),
+        "date": Get("MatchDateTime") | Custom(_parse_datetime),
         "is_finished": Get("MatchIsFinished"),
         "group": Get("Group") | GetOrCreate(Group, match_targets=["id"]),
+        "host": Get("Team1") | GetOrCreate(Team, match_targets=["id"]),
+        "guest": Get("Team2") | GetOrCreate(Team, match_targets=["id"]),
         "match_participations": Custom(lambda data: [
             {"MatchID": data["MatchID"], "Team": data["Team1"], "hosted": True},
             {"MatchID": data["MatchID"], "Team": data["Team2"], "hosted": False},
         ]) | CreateMultiple(MatchParticipation),
-        "host_points": Get("MatchResults") | Filter(lambda item: "end" in item["ResultName"].lower()) | If(
+        "host_points": final_results | If(
             cond=lambda data: len(data) > 0,
             then=Get(0) | Get("PointsTeam1"),
             else_=Constant(0)
         ),
-        "guest_points": Get("MatchResults") | Filter(lambda item: "end" in item["ResultName"].lower()) | If(
+        "guest_points": final_results | If(
             cond=lambda data: len(data) > 0,
             then=Get(0) | Get("PointsTeam2"),
             else_=Constant(0)
@@ -76,60 +100,296 @@ def clean_download_list(session: Session, years: List[int]) -> Tuple[List[int],
 
 
 base_url = "https://www.openligadb.de/api/getmatchdata/{league}/{year}"
+group_url = "https://www.openligadb.de/api/getmatchdata/{league}/{year}/{group}"
+current_url = "https://www.openligadb.de/api/getmatchdata/{league}"
+
+# the current group only changes on matchdays, thus it is fine to not even revalidate it for a while
+current_matches_ttl = 5 * 60
+
+response_cache = ResponseCache(os.path.join(project_dir, ".cache", "openligadb"))
+
+
+T = TypeVar("T")
+
+
+def _fetch_json(
+    urls: Dict[str, T], concurrency: int = 4, cache: Optional[ResponseCache] = response_cache,
+    on_response: Optional[Callable[[T, Response], None]] = None
+) -> Generator[Tuple[T, Any], None, None]:
+    """Fetch the json data behind the given urls
+
+    The requests are sent concurrently by an AsyncFetcher, which reuses its
+    connections and retries failed requests. Responses are cached, so data which
+    didn't change since the last fetch only costs a conditional request.
 
+    :param urls: urls to fetch, mapped onto keys identifying them
+    :param concurrency: maximum number of concurrent requests (default value = 4)
+    :param cache: response cache to use, None disables caching (default value = response_cache)
+    :param on_response: called with the key and the raw response before its data is decoded (default value = None)
 
-def _download_matches(years: List[int], league: Optional[str] = None) -> Generator[Dict[str, Any], None, None]:
+    """
+    for response in AsyncFetcher(concurrency=concurrency, cache=cache).fetch_all(urls):
+        key = urls[response.requested_url]
+        if on_response is not None:
+            on_response(key, response)
+        yield key, response.json()
+
+
+def _download_matches(
+    years: List[int], league: Optional[str] = None, concurrency: int = 4, url: str = base_url, cache: Optional[ResponseCache] = response_cache,
+    archive: Optional[ResponseArchive] = None
+) -> Generator[Tuple[int, Any], None, None]:
     """Download all matches from the given years
 
-    This is a "private" method, which does the job of actually downloading the data.
-    To make this fast we use a ThreadPoolExecutor, as the actual sending of the request
-    is blocking which can easily be done in parallel.
+    This is a "private" method, which does the job of actually downloading the data,
+    see `_fetch_json`.
 
     :param years: list of year to download matches of
     :param league: key od league to download matches of (default value = None)
+    :param concurrency: maximum number of concurrent requests (default value = 4)
+    :param url: url template to download from (default value = base_url)
+    :param cache: response cache to use, None disables caching (default value = response_cache)
+    :param archive: archive to append the raw responses to (default value = None)
 
     """
-    def download_job(year):
-        url = base_url.format(league=league or "bl1", year=year)
-        return year, requests.get(url)
+    league = league or "bl1"
+
+    def archive_response(year: int, response: Response) -> None:
+        archive.append(league, year, response.body)  # type: ignore
+
+    urls = {url.format(league=league, year=year): year for year in years}
+    return _fetch_json(urls, concurrency, cache, archive_response if archive is not None else None)
 
-    with ThreadPoolExecutor(max_workers=len(years)) as executor:
-        downloads = [executor.submit(download_job, year) for year in years]
-        for future in as_completed(downloads):
-            year, response = future.result()
-            response.raise_for_status()
-            yield year, response.json()
 
+def _add_to_season(match: Match, season: Season) -> None:
+    match.group.season = season
 
-def download_matches(session: Session, years: List[int], league: Optional[str] = None) -> Generator[Match, None, None]:
+    if season not in match.host.seasons:
+        match.host.seasons.append(season)
+
+    if season not in match.guest.seasons:
+        match.guest.seasons.append(season)
+
+
+def download_matches(
+    session: Session, years: List[int], league: Optional[str] = None, batch_size: Optional[int] = None, concurrency: int = 4,
+    use_cache: bool = True, archive: Optional[ResponseArchive] = None
+) -> Generator[Match, None, None]:
     """Download and process all matches from the given years
 
+    Without a batch size the matches are merely yielded and it is up to the caller
+    to add them to the session. With a batch size they are added and committed in
+    chunks, each season ending with a commit of its own, see `Pipeline.create_multiple`.
+    Thus a batch size of at least the number of matches per season results in one
+    transaction per season.
+
     :param session: DB session to interact with
     :param years: list of year to download matches of
     :param league: key od league to download matches of (default value = None)
+    :param batch_size: number of matches to commit at once (default value = None)
+    :param concurrency: maximum number of concurrent downloads (default value = 4)
+    :param use_cache: whether to use the response cache (default value = True)
+    :param archive: archive to append the raw responses to (default value = None)
 
     """
-    for year, data in _download_matches(years, league):
+    seasons = _download_matches(years, league, concurrency, cache=response_cache if use_cache else None, archive=archive)
+    return ingest_seasons(session, seasons, batch_size)
+
+
+def ingest_seasons(session: Session, seasons: Iterable[Tuple[int, Any]], batch_size: Optional[int] = None) -> Generator[Match, None, None]:
+    """Process the raw match data of whole seasons
+
+    See `download_matches` for the meaning of the batch size.
+
+    :param session: DB session to interact with
+    :param seasons: pairs of year and raw match data of the season
+    :param batch_size: number of matches to commit at once (default value = None)
+
+    """
+    pipeline.reset_identity_map()
+    for year, data in seasons:
         season = Season(year=year)  # type: ignore
 
-        for match in pipeline.create_multiple(Match, data, session):  # type: ignore
+        for match in pipeline.create_multiple(Match, data, session, batch_size):  # type: ignore
             match = cast(Match, match)  # this cast is required for "proper typing2...i.e. typevars are annoying
-            match.group.season = season
+            with pipeline.measure("season association"):
+                _add_to_season(match, season)
+            yield match
 
-            if season not in match.host.seasons:
-                match.host.seasons.append(season)
 
-            if season not in match.guest.seasons:
-                match.guest.seasons.append(season)
+def pending_years(session: Session, years: Iterable[int]) -> List[int]:
+    """Filter the years, which aren't completely ingested yet
 
-            yield match
+    A season is complete once it has a season checkpoint. Seasons which are present
+    without any checkpoints, i.e. which weren't ingested via `checkpointed_ingest`,
+    are considered complete as well.
 
+    :param session: DB session to interact with
+    :param years: years to filter
+    :return: the years to (re)download
+
+    """
+    checkpoints = session.query(IngestCheckpoint.year, IngestCheckpoint.group_order_id).all()
+    completed = {year for year, order_id in checkpoints if order_id is None}
+    checkpointed = {year for year, _ in checkpoints}
+    completed.update(year for (year,) in session.query(Season.year) if year not in checkpointed)
+    return [year for year in years if year not in completed]
+
+
+def checkpointed_ingest(session: Session, seasons: Iterable[Tuple[int, Any]]) -> Generator[Match, None, None]:
+    """Process the raw match data of whole seasons, committing each group on its own
 
-def get_current_groups_matches() -> List[Tuple[str, str]]:
-    """Get the matches of the current group"""
-    response = requests.get("https://www.openligadb.de/api/getmatchdata/bl1")
-    response.raise_for_status()
-    data = response.json()
+    Every group is committed in a transaction of its own, together with an
+    IngestCheckpoint marking it as completed, and every season once all its groups
+    are. Groups which already have a checkpoint are skipped, thus processing a
+    partially ingested season again picks up where the last run stopped.
+    Matches are committed when the next group is started, thus they must not be
+    used after the next match was requested, see `Pipeline.create_multiple`.
+
+    :param session: DB session to interact with
+    :param seasons: pairs of year and raw match data of the season
+
+    """
+    completed_groups = set(session.query(IngestCheckpoint.year, IngestCheckpoint.group_order_id).filter(
+        IngestCheckpoint.group_order_id.isnot(None)
+    ))
+
+    pipeline.reset_identity_map()
+    for year, data in seasons:
+        season = session.query(Season).filter(Season.year == year).first() or Season(year=year)  # type: ignore
+
+        groups: Dict[int, List[Any]] = {}
+        for row in data:
+            groups.setdefault(row["Group"]["GroupOrderID"], []).append(row)
+
+        for order_id, rows in groups.items():
+            if (year, order_id) in completed_groups:
+                continue
+            for match in pipeline.create_multiple(Match, rows, session):  # type: ignore
+                match = cast(Match, match)
+                _add_to_season(match, season)
+                session.add(match)
+                yield match
+            session.add(IngestCheckpoint(year=year, group_order_id=order_id))  # type: ignore
+            pipeline.commit(session)
+
+        session.add(IngestCheckpoint(year=year))  # type: ignore
+        pipeline.commit(session)
+
+
+def backfill_matches(
+    session: Session, years: List[int], league: Optional[str] = None, concurrency: int = 4, use_cache: bool = True,
+    archive: Optional[ResponseArchive] = None
+) -> Generator[Match, None, None]:
+    """Download and process all matches from the given years, resuming an interrupted run
+
+    Only the seasons which aren't complete yet are downloaded, see `pending_years`,
+    and processed group by group, see `checkpointed_ingest`. If the run fails,
+    e.g. because a download ultimately fails, every completed group stays committed.
+
+    :param session: DB session to interact with
+    :param years: list of year to download matches of
+    :param league: key od league to download matches of (default value = None)
+    :param concurrency: maximum number of concurrent downloads (default value = 4)
+    :param use_cache: whether to use the response cache (default value = True)
+    :param archive: archive to append the raw responses to (default value = None)
+
+    """
+    years = pending_years(session, years)
+    seasons = _download_matches(years, league, concurrency, cache=response_cache if use_cache else None, archive=archive)
+    return checkpointed_ingest(session, seasons)
+
+
+# fields of a match which may change after it was first stored
+sync_fields = ("date", "is_finished", "host_points", "guest_points")
+
+# mid-season every future matchday is stale, beyond this many stale groups
+# a season is fetched with one request instead of one per group
+max_stale_groups = 3
+
+
+def find_stale_groups(session: Session) -> Dict[int, List[int]]:
+    """Find all groups which contain unfinished matches
+
+    :param session: DB session to interact with
+    :return: the order ids of the stale groups by year
+
+    """
+    stale_groups: Dict[int, List[int]] = {}
+    for year, order_id in session.query(Season.year, Group.order_id).select_from(Match).join(Match.group, Group.season).filter(
+        not_(Match.is_finished)
+    ).distinct().order_by(Season.year, Group.order_id):
+        stale_groups.setdefault(year, []).append(order_id)
+    return stale_groups
+
+
+def sync_matches(
+    session: Session, years: Iterable[int] = (), league: Optional[str] = None, concurrency: int = 4, use_cache: bool = True,
+    url: str = base_url, group_url: str = group_url
+) -> Generator[Tuple[Match, bool], None, None]:
+    """Update all stale matches in place
+
+    Only the groups containing unfinished matches are fetched, unless a season
+    is explicitly requested or more than `max_stale_groups` of its groups are
+    stale, in which case the whole season is fetched with a single request.
+    Matches are matched by their MatchID, the changed fields of existing matches
+    are updated and new matches are created. Every updated or created match is
+    yielded along with whether it was created, it is up to the caller to commit the changes.
+
+    :param session: DB session to interact with
+    :param years: seasons to fetch completely (default value = ())
+    :param league: key od league to sync matches of (default value = None)
+    :param concurrency: maximum number of concurrent downloads (default value = 4)
+    :param use_cache: whether to use the response cache (default value = True)
+    :param url: url template to download whole seasons from (default value = base_url)
+    :param group_url: url template to download single groups from (default value = group_url)
+
+    """
+    league = league or "bl1"
+    years = list(years)
+    stale_groups = find_stale_groups(session)
+    years += [year for year, order_ids in stale_groups.items() if year not in years and len(order_ids) > max_stale_groups]
+    urls = {url.format(league=league, year=year): year for year in years}
+    for year, order_ids in stale_groups.items():
+        if year not in years:
+            urls.update({group_url.format(league=league, year=year, group=order_id): year for order_id in order_ids})
+    if not urls:
+        return
+
+    pipeline.reset_identity_map()
+    seasons = {season.year: season for season in session.query(Season)}
+    for year, data in _fetch_json(urls, concurrency, cache=response_cache if use_cache else None):
+        if year not in seasons:
+            seasons[year] = Season(year=year)  # type: ignore
+
+        existing = {match.id: match for match in session.query(Match).filter(Match.id.in_([row["MatchID"] for row in data]))}
+        for row in data:
+            match = existing.get(row["MatchID"])
+            if match is None:
+                match = pipeline.create(Match, row, session)  # type: ignore
+                _add_to_season(match, seasons[year])
+                session.add(match)
+                yield match, True
+            else:
+                changed = False
+                for key in sync_fields:
+                    value = pipeline.generate_kwarg(Match, key, row, session)  # type: ignore
+                    if getattr(match, key) != value:
+                        setattr(match, key, value)
+                        changed = True
+                if changed:
+                    yield match, False
+
+
+def get_current_groups_matches(league: Optional[str] = None, cache: Optional[ResponseCache] = response_cache) -> List[Tuple[str, str]]:
+    """Get the matches of the current group
+
+    :param league: key od league to get the current group of (default value = None)
+    :param cache: response cache to use, None disables caching (default value = response_cache)
+
+    """
+    url = current_url.format(league=league or "bl1")
+    data = AsyncFetcher(cache=cache).get(url, ttl=current_matches_ttl).json()
     return (
         data[0]["LeagueName"],
         data[0]["Group"]["GroupOrderID"],
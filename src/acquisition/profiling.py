@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+from contextlib import contextmanager
+from dataclasses import dataclass
+from time import perf_counter
+from typing import Dict, Tuple, List, Generator, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine.base import Engine
+
+
+__all__ = (
+    "Profiler",
+)
+
+
+@dataclass
+class _Stats:
+    calls: int = 0
+    cumulative_time: float = 0.
+    self_time: float = 0.
+    queries: int = 0
+    self_queries: int = 0
+
+
+@dataclass
+class _Frame:
+    path: Tuple[str, ...]
+    children_time: float = 0.
+    children_queries: int = 0
+
+
+class Profiler:
+    """Records call counts, timings and DB round trips of nested measurements
+
+    Measurements are identified by their path, i.e. the labels of all enclosing
+    measurements, so the same transformation used in different fields is
+    reported separately for each field.
+    """
+    def __init__(self) -> None:
+        self.stats: Dict[Tuple[str, ...], _Stats] = {}
+        self._order: Dict[Tuple[str, ...], int] = {}
+        self._stack: List[_Frame] = []
+        self._queries = 0
+        self._engines: List[Engine] = []
+
+    @contextmanager
+    def measure(self, label: str) -> Generator[None, None, None]:
+        """Measure the enclosed block
+
+        :param label: label of the measurement
+
+        """
+        frame = _Frame((self._stack[-1].path if self._stack else ()) + (label,))
+        self._order.setdefault(frame.path, len(self._order))
+        self._stack.append(frame)
+        start_time, start_queries = perf_counter(), self._queries
+        try:
+            yield
+        finally:
+            elapsed, queries = perf_counter() - start_time, self._queries - start_queries
+            self._stack.pop()
+
+            stats = self.stats.setdefault(frame.path, _Stats())
+            stats.calls += 1
+            stats.cumulative_time += elapsed
+            stats.self_time += elapsed - frame.children_time
+            stats.queries += queries
+            stats.self_queries += queries - frame.children_queries
+
+            if self._stack:
+                self._stack[-1].children_time += elapsed
+                self._stack[-1].children_queries += queries
+
+    def attach(self, engine: Engine) -> None:
+        """Start counting the statements executed by an engine
+
+        :param engine: engine to count the statements of
+
+        """
+        event.listen(engine, "before_cursor_execute", self._count_query)
+        self._engines.append(engine)
+
+    def detach(self) -> None:
+        """Stop counting statements of all attached engines"""
+        for engine in self._engines:
+            event.remove(engine, "before_cursor_execute", self._count_query)
+        self._engines.clear()
+
+    def _count_query(self, *args) -> None:
+        self._queries += 1
+
+    def format_table(self, max_label_length: Optional[int] = 60) -> str:
+        """Format the recorded stats as a table, nested measurements are indented
+
+        :param max_label_length: length at which labels are cut off (default: 60)
+
+        """
+        width = max_label_length or max((2 * len(path) + len(path[-1]) for path in self.stats), default=0)
+        lines = [
+            f"{'name':<{width}} {'calls':>8} {'cumulative':>11} {'self':>9} {'queries':>8} {'self queries':>13}",
+            "-" * (width + 54),
+        ]
+        # order the measurements as a tree, siblings in the order they were first entered
+        for path, stats in sorted(self.stats.items(), key=lambda item: [self._order[item[0][:i]] for i in range(1, len(item[0]) + 1)]):
+            label = "  " * (len(path) - 1) + path[-1]
+            if len(label) > width:
+                label = label[:width - 3] + "..."
+            lines.append(
+                f"{label:<{width}} {stats.calls:>8} {stats.cumulative_time:>10.3f}s {stats.self_time:>8.3f}s "
+                f"{stats.queries:>8} {stats.self_queries:>13}"
+            )
+        return "\n".join(lines)
@@ -1,8 +1,10 @@
+from operator import itemgetter, attrgetter
 from typing import TypeVar, Callable, List, Type, overload, Dict, Any, Optional, Sequence, Mapping, Iterable
 
+import numpy as np
 from sqlalchemy.orm import Session
 
-from .core import Transformation, Pipeline
+from .core import Transformation, Pipeline, _map_column
 
 
 __all__ = (
@@ -44,6 +46,16 @@ def Get(pipeline: Pipeline, data, session: Session, key):
     return data[key]
 
 
+@Get.emitter
+def _emit_get(codegen, src: str, key) -> str:
+    return codegen.assign(f"{src}[{codegen.const(key)}]")
+
+
+@Get.columnar
+def _get_columns(pipeline: Pipeline, column: np.ndarray, session: Session, key) -> np.ndarray:
+    return _map_column(itemgetter(key), column)
+
+
 @Transformation.from_func
 def Custom(pipeline: Pipeline, data: T, session: Session, func: Callable[[T], K]) -> K:
     """Apply custom function
@@ -54,6 +66,16 @@ def Custom(pipeline: Pipeline, data: T, session: Session, func: Callable[[T], K]
     return func(data)
 
 
+@Custom.emitter
+def _emit_custom(codegen, src: str, func: Callable) -> str:
+    return codegen.assign(f"{codegen.const(func)}({src})")
+
+
+@Custom.columnar
+def _custom_columns(pipeline: Pipeline, column: np.ndarray, session: Session, func: Callable) -> np.ndarray:
+    return _map_column(func, column)
+
+
 @Transformation.from_func
 def Constant(pipeline: Pipeline, data: Any, session: Session, constant: T) -> T:
     """Return a constant
@@ -64,6 +86,18 @@ def Constant(pipeline: Pipeline, data: Any, session: Session, constant: T) -> T:
     return constant
 
 
+@Constant.emitter
+def _emit_constant(codegen, src: str, constant: Any) -> str:
+    return codegen.const(constant)
+
+
+@Constant.columnar
+def _constant_columns(pipeline: Pipeline, column: np.ndarray, session: Session, constant: Any) -> np.ndarray:
+    result = np.empty(len(column), dtype=object)
+    result.fill(constant)
+    return result
+
+
 @Transformation.from_func
 def Attr(pipeline: Pipeline, data: Any, session: Session, key: str) -> Any:
     """Get a single attribute from object
@@ -74,6 +108,16 @@ def Attr(pipeline: Pipeline, data: Any, session: Session, key: str) -> Any:
     return getattr(data, key)
 
 
+@Attr.emitter
+def _emit_attr(codegen, src: str, key: str) -> str:
+    return codegen.assign(f"getattr({src}, {codegen.const(key)})")
+
+
+@Attr.columnar
+def _attr_columns(pipeline: Pipeline, column: np.ndarray, session: Session, key: str) -> np.ndarray:
+    return _map_column(attrgetter(key), column)
+
+
 @Transformation.from_func
 def Filter(pipeline: Pipeline, data: Iterable[T], session: Session, pred: Callable[[T], bool]) -> List[T]:
     """Filter a list via a predicate
@@ -84,6 +128,16 @@ def Filter(pipeline: Pipeline, data: Iterable[T], session: Session, pred: Callab
     return [x for x in iter(data) if pred(x)]
 
 
+@Filter.emitter
+def _emit_filter(codegen, src: str, pred: Callable) -> str:
+    return codegen.assign(f"[x for x in {src} if {codegen.const(pred)}(x)]")
+
+
+@Filter.columnar
+def _filter_columns(pipeline: Pipeline, column: np.ndarray, session: Session, pred: Callable) -> np.ndarray:
+    return _map_column(lambda data: [x for x in data if pred(x)], column)
+
+
 @Transformation.from_func
 def Map(pipeline: Pipeline, data: Iterable[T], session: Session, func: Callable[[T], K]) -> List[K]:
     """Apply a function to each element in list
@@ -94,6 +148,16 @@ def Map(pipeline: Pipeline, data: Iterable[T], session: Session, func: Callable[
     return [func(x) for x in iter(data)]
 
 
+@Map.emitter
+def _emit_map(codegen, src: str, func: Callable) -> str:
+    return codegen.assign(f"[{codegen.const(func)}(x) for x in {src}]")
+
+
+@Map.columnar
+def _map_columns(pipeline: Pipeline, column: np.ndarray, session: Session, func: Callable) -> np.ndarray:
+    return _map_column(lambda data: [func(x) for x in data], column)
+
+
 @Transformation.from_func
 def Gather(pipeline: Pipeline, data: Mapping[T, K], session: Session, *names: Sequence[T]) -> Dict[T, K]:
     """Gather multiple different values into a list
@@ -104,6 +168,11 @@ def Gather(pipeline: Pipeline, data: Mapping[T, K], session: Session, *names: Se
     return {name: data[name] for name in names}
 
 
+@Gather.emitter
+def _emit_gather(codegen, src: str, *names) -> str:
+    return codegen.assign("{" + ", ".join(f"{codegen.const(name)}: {src}[{codegen.const(name)}]" for name in names) + "}")
+
+
 @Transformation.from_func
 def If(pipeline: Pipeline, data: T, session: Session, cond: Callable[[T], bool], then: Transformation, else_: Optional[Transformation] = None) -> Any:
     """Condtionally execute or branch between Transformations
@@ -121,10 +190,36 @@ def If(pipeline: Pipeline, data: T, session: Session, cond: Callable[[T], bool],
         return None
 
 
+@If.emitter
+def _emit_if(codegen, src: str, cond: Callable, then: Transformation, else_: Optional[Transformation] = None) -> str:
+    result = codegen.variable()
+    with codegen.block(f"if {codegen.const(cond)}({src}):"):
+        codegen.emit(f"{result} = {codegen.chain(then.steps, src)}")
+    with codegen.block("else:"):
+        codegen.emit(f"{result} = {codegen.chain(else_.steps, src) if else_ is not None else None}")
+    return result
+
+
+@If.columnar
+def _if_columns(
+    pipeline: Pipeline, column: np.ndarray, session: Session, cond: Callable, then: Transformation, else_: Optional[Transformation] = None
+) -> np.ndarray:
+    # each branch only sees the rows it is taken for, just like in the row-wise variant
+    mask = _map_column(cond, column).astype(bool)
+    result = np.full(len(column), None, dtype=object)
+    result[mask] = then.apply_columns(pipeline, column[mask], session)
+    if else_ is not None:
+        result[~mask] = else_.apply_columns(pipeline, column[~mask], session)
+    return result
+
+
 @Transformation.from_func
 def GetOrCreate(pipeline: Pipeline, data: Any, session: Session, model: Type[M], match_targets: Optional[List[str]] = None) -> M:
     """Get or create an instant model from data
 
+    Lookups go through the identity map of the pipeline, thus each instance
+    is queried or created at most once per run.
+
     :param model: model to get or create an instance for
     :param match_targets: fields to match on (default: None)
 
@@ -137,13 +232,15 @@ def GetOrCreate(pipeline: Pipeline, data: Any, session: Session, model: Type[M],
             for key in match_targets
         }
 
-    instance = session.query(model).filter_by(**kwargs).first()
-    if not instance:
+    identity_map = pipeline.get_identity_map(model, list(kwargs.keys()), session)
+    identity = tuple(kwargs.values())
+    instance = identity_map.get(identity)
+    if instance is None:
         if match_targets is not None:
             kwargs = pipeline.generate_kwargs(model, data, session)
         instance = model(**kwargs)  # type: ignore
         session.add(instance)
-        session.commit()
+        identity_map[identity] = instance
     return instance
 
 
@@ -156,7 +253,6 @@ def Create(pipeline: Pipeline, data: Any, session: Session, model: Type[M]) -> M
     """
     instance = pipeline.create(model, data, session)
     session.add(instance)
-    session.commit()
     return instance
 
 
@@ -171,5 +267,4 @@ def CreateMultiple(pipeline: Pipeline, data: Sequence[Any], session: Session, mo
     for instance_data in data:
         instances.append(pipeline.create(model, instance_data, session))
     session.add_all(instances)
-    session.commit()
     return instances
@@ -1,12 +1,17 @@
+from contextlib import nullcontext
+
 import click
 
 from sqlalchemy import or_
 
 from .db import DB
 from .db.models import *  # noqa: F401
-from .db.selectors import RangePoint, RangeSelector
+from .db.selectors import RangePoint, RangeSelector, season_years
 from .prediction import Model
-from .acquisition import download_matches, clean_download_list, get_current_groups_matches
+from .acquisition import (
+    pipeline, download_matches, ingest_seasons, backfill_matches, pending_years, sync_matches, bulk_ingest, convert_seasons, download_rows,
+    read_dump_rows, clean_download_list, get_current_groups_matches, ResponseArchive
+)
 from .ui import App
 
 
@@ -53,7 +58,17 @@ def drop(yes):
 @db.command()
 @click.argument("years", nargs=-1, type=int)
 @click.option("-d", "--drop", is_flag=True, help="drop all tables before downloading matches")
-def download(years, drop):
+@click.option("-b", "--batch-size", type=int, default=306, show_default=True, help="number of matches to commit at once, 0 commits everything at the end")
+@click.option("-c", "--concurrency", type=click.IntRange(min=1), default=4, show_default=True, help="maximum number of concurrent downloads")
+@click.option("--no-cache", is_flag=True, help="bypass the response cache")
+@click.option("--bulk", is_flag=True, help="convert seasons in worker processes and insert them in bulk, one transaction per season")
+@click.option("--profile", is_flag=True, help="print the time and queries spent per transformation, not supported with --bulk")
+@click.option("--archive", type=click.Path(dir_okay=False), default=None, help="append the raw responses to this archive")
+def download(years, drop, batch_size, concurrency, no_cache, bulk, profile, archive):
+    if bulk and profile:
+        raise click.UsageError("--profile can't be combined with --bulk")
+    archive = ResponseArchive(archive) if archive else None
+
     if drop and click.confirm("Are you sure you want to drop all tables?", abort=True):
         print("dropping tables...")
         DB.drop_tables()
@@ -68,16 +83,127 @@ def download(years, drop):
         elif len(skipped_years) > 0:
             print("Skipping ", ", ".join(map(str, skipped_years)), f"as {'they are' if len(skipped_years) > 1 else 'it is'} already present.")
 
+    if bulk:
+        with click.progressbar(
+            bulk_ingest(DB.get_engine("ingest"), download_rows(years_to_download, concurrency=concurrency, use_cache=not no_cache, archive=archive)),
+            length=len(years_to_download),
+            label="downloading seasons...",
+            show_eta=True, show_percent=True, show_pos=True
+        ) as result:
+            for _ in result:
+                ...
+        print("done")
+        return
+
+    with DB.get_session(profile="ingest") as session, pipeline.profile(DB.get_engine("ingest")) if profile else nullcontext() as profiler:
+        with click.progressbar(
+            download_matches(
+                session, years_to_download, batch_size=batch_size or None, concurrency=concurrency, use_cache=not no_cache, archive=archive
+            ),
+            length=len(years_to_download) * 306,
+            label="downloading matches...",
+            show_eta=True, show_percent=True, show_pos=True
+        ) as result:
+            for match in result:
+                if not batch_size:
+                    session.add(match)
+    print("done")
+    if profiler is not None:
+        print(profiler.format_table())
+
+
+@db.command()
+@click.argument("years", nargs=-1, type=int)
+@click.option("-c", "--concurrency", type=click.IntRange(min=1), default=4, show_default=True, help="maximum number of concurrent downloads")
+@click.option("--no-cache", is_flag=True, help="bypass the response cache")
+@click.option("--archive", type=click.Path(dir_okay=False), default=None, help="append the raw responses to this archive")
+def backfill(years, concurrency, no_cache, archive):
+    """Download the given years group by group, resuming where an interrupted backfill stopped."""
+    with DB.get_session(profile="ingest") as session:
+        years_to_download = pending_years(session, years)
+        if len(years_to_download) == 0:
+            print("All seasons already present, none will be downloaded.")
+            return
+
         with click.progressbar(
-            download_matches(session, years_to_download),
+            backfill_matches(
+                session, years_to_download, concurrency=concurrency, use_cache=not no_cache, archive=ResponseArchive(archive) if archive else None
+            ),
             length=len(years_to_download) * 306,
             label="downloading matches...",
             show_eta=True, show_percent=True, show_pos=True
         ) as result:
-            session.add_all(list(result))
+            for _ in result:
+                ...
     print("done")
 
 
+@db.command()
+@click.option("--from-archive", "archive", type=click.Path(exists=True, dir_okay=False), required=True, help="archive to replay")
+@click.option("-l", "--league", type=str, default=None, help="key of the league to replay  [default: bl1]")
+@click.option("--bulk", is_flag=True, help="convert seasons in worker processes and insert them in bulk, one transaction per season")
+@click.option("-y", "--yes", is_flag=True, help="skip confirmation prompt")
+def rebuild(archive, league, bulk, yes):
+    """Drop all tables and re-derive the DB from the latest archived responses."""
+    if not yes:
+        click.confirm("Are you sure you want to drop all tables?", abort=True)
+    archive = ResponseArchive(archive)
+    years = sorted(archive.latest_frames(league))
+    DB.drop_tables()
+    DB.create_tables()
+
+    if bulk:
+        with click.progressbar(
+            bulk_ingest(DB.get_engine("ingest"), convert_seasons(archive.replay(league))),
+            length=len(years),
+            label="rebuilding seasons...",
+            show_eta=True, show_percent=True, show_pos=True
+        ) as result:
+            for _ in result:
+                ...
+    else:
+        with DB.get_session(profile="ingest") as session:
+            with click.progressbar(
+                ingest_seasons(session, archive.replay(league), batch_size=306),
+                length=len(years) * 306,
+                label="rebuilding matches...",
+                show_eta=True, show_percent=True, show_pos=True
+            ) as result:
+                for _ in result:
+                    ...
+    print(f"done, {len(years)} seasons rebuilt")
+
+
+@db.command(name="import")
+@click.argument("source", type=click.Path(exists=True))
+@click.option("-w", "--workers", type=click.IntRange(min=1), default=None, help="number of worker processes  [default: one per cpu]")
+def import_(source, workers):
+    """Import raw match data from a directory or archive of json dumps."""
+    imported = 0
+    for rows, skipped in bulk_ingest(DB.get_engine("ingest"), read_dump_rows(source, workers)):
+        if skipped:
+            print(f"Skipping {rows.year} as it is already present.")
+        else:
+            imported += len(rows.matches)
+    print(f"done, {imported} matches imported")
+
+
+@db.command()
+@click.argument("years", nargs=-1, type=int)
+@click.option("-c", "--concurrency", type=click.IntRange(min=1), default=4, show_default=True, help="maximum number of concurrent downloads")
+@click.option("--no-cache", is_flag=True, help="bypass the response cache")
+def sync(years, concurrency, no_cache):
+    """Update unfinished matches, and all matches of the given years."""
+    with DB.get_session(profile="ingest") as session:
+        created, updated = 0, 0
+        for _, was_created in sync_matches(session, years, concurrency=concurrency, use_cache=not no_cache):
+            if was_created:
+                created += 1
+            else:
+                updated += 1
+    print(f"done, {created} matches created, {updated} matches updated")
+
+
 @cli.command()
 @click.argument("host", type=str, nargs=1)
 @click.argument("guest", type=str, nargs=1)
@@ -132,9 +258,10 @@ def handle_selector(start, end, session):
     end = RangePoint.parse_from_string(end)
 
     errors = []
-    if start.year is not None and session.query(Season).filter(Season.year >= start.year).count() < 1:
+    years = season_years(RangeSelector(), session)
+    if start.year is not None and not any(year >= start.year for year in years):
         errors.append(f"Couldn't find any year >= {start.year} in database.")
-    if end.year is not None and session.query(Season).filter(Season.year <= end.year).count() < 1:
+    if end.year is not None and not any(year <= end.year for year in years):
         errors.append(f"Couldn't find any year <= {end.year} in database.")
     if start.group is not None and start.group not in range(1, 35):
         errors.append(f"Group of lower bound must be in 1..34. Not {start.group}...")
@@ -164,7 +291,7 @@ def matches(start, end):
             for error in errors:
                 print("ERR:", error)
         else:
-            print(*selector.build_match_query().with_session(session), sep="\n")
+            print(*selector.build_match_query(load="selectin").with_session(session), sep="\n")
 
 
 @query.command()
@@ -177,4 +304,4 @@ def teams(start, end):
             for error in errors:
                 print("ERR:", error)
         else:
-            print(*selector.build_team_query().with_session(session), sep="\n")
+            print(*selector.build_team_query(load="selectin").with_session(session), sep="\n")
@@ -1,8 +1,10 @@
 from .models import *
 from .core import *
 from .selectors import *
+from .frames import *
+from .cache import *
 
-__all__ = models.__all__ + core.__all__ + selectors.__all__
+__all__ = models.__all__ + core.__all__ + selectors.__all__ + frames.__all__ + cache.__all__
 
 
 DB.create_tables()
@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from itertools import chain
+from threading import Lock
+from typing import Any, Callable, Optional, Tuple, TypeVar, Union
+
+from sqlalchemy import MetaData, Table, Column, Integer, event, select
+from sqlalchemy.engine.base import Connection
+from sqlalchemy.orm import Session
+
+
+__all__ = (
+    "QueryCache",
+    "query_cache",
+    "current_generation",
+    "bump_generation",
+)
+
+
+T = TypeVar("T")
+
+# kept apart from the metadata of the models, so the generation never restarts when all tables are dropped
+generation_table = Table(
+    "data_generation", MetaData(),
+    Column("id", Integer, primary_key=True),
+    Column("generation", Integer, nullable=False, default=0),
+)
+
+# changes to rows of these tables invalidate cached query results
+data_tables = {"seasons", "teams", "groups", "matches", "match_participations"}
+
+
+def current_generation(connection: Union[Connection, Session]) -> int:
+    """Get the data generation of the DB, which is bumped by every change of the match data
+
+    :param connection: connection or session of the DB
+
+    """
+    return connection.execute(select([generation_table.c.generation]).where(generation_table.c.id == 1)).scalar() or 0
+
+
+def bump_generation(connection: Union[Connection, Session]) -> None:
+    """Bump the data generation of the DB, this has to be done by every write bypassing the ORM
+
+    :param connection: connection or session of the DB
+
+    """
+    table = generation_table
+    if connection.execute(table.update().where(table.c.id == 1).values(generation=table.c.generation + 1)).rowcount == 0:
+        connection.execute(table.insert().values(id=1, generation=1))
+
+
+@event.listens_for(Session, "after_flush")
+def _bump_generation_on_flush(session: Session, flush_context: Any) -> None:
+    if any(getattr(instance, "__tablename__", None) in data_tables for instance in chain(session.new, session.dirty, session.deleted)):
+        bump_generation(session.connection())
+
+
+class QueryCache:
+    """In memory cache of query results, keyed by a selector and the kind of the query
+
+    A cached result is valid as long as the data generation of the DB didn't change,
+    i.e. until the next ingest or sync. Looking up the generation is a single primary
+    key lookup, which is way cheaper than the cached queries. Results are shared
+    between all callers, thus they must not be mutated.
+    """
+    def __init__(self, maxsize: int = 256) -> None:
+        self.maxsize = maxsize
+        self._entries: OrderedDict[Tuple[Any, ...], Tuple[int, Any]] = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, session: Session, kind: str, selector: Optional[Any], compute: Callable[[Session], T]) -> T:
+        """Get a query result from the cache, or compute it
+
+        :param session: DB session to interact with
+        :param kind: kind of the query
+        :param selector: hashable selection the query depends on, e.g. a RangeSelector
+        :param compute: function running the query in the given session
+
+        """
+        key = (str(session.get_bind().url), kind, getattr(selector, "key", selector))
+        generation = current_generation(session)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == generation:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        value = compute(session)
+        with self._lock:
+            self._entries[key] = (generation, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def cached(self, kind: str) -> Callable[[Callable[[Any, Session], T]], Callable[[Any, Session], T]]:
+        """Decorator, which caches the results of a function of a selector and a session.
+
+        :param kind: kind of the query
+
+        """
+        def decorator(func: Callable[[Any, Session], T]) -> Callable[[Any, Session], T]:
+            def wrapper(selector: Any, session: Session) -> T:
+                return self.get(session, kind, selector, lambda session: func(selector, session))
+            wrapper.__name__, wrapper.__doc__, wrapper.__wrapped__ = func.__name__, func.__doc__, func  # type: ignore
+            return wrapper
+        return decorator
+
+    def clear(self) -> None:
+        """Remove all cached results"""
+        with self._lock:
+            self._entries.clear()
+
+
+query_cache = QueryCache()
@@ -1,21 +1,32 @@
 from __future__ import annotations
 
 import os
+from concurrent.futures import Future
 from contextlib import contextmanager
-from typing import Generator, Type, ClassVar, Dict, List
+from typing import Generator, Type, ClassVar, Dict, List, Any, Optional, Callable, TypeVar
 
-from sqlalchemy import create_engine, Column, Integer
+from sqlalchemy import create_engine, event, exc, inspect, Column, Integer
 from sqlalchemy.orm import sessionmaker, scoped_session, Session, Query
 from sqlalchemy.engine.base import Engine
+from sqlalchemy.engine.url import make_url
 from sqlalchemy.ext.declarative import as_declarative
+from sqlalchemy.pool import QueuePool, StaticPool
+
+from .migrations import Migration, migrate
+from .cache import generation_table, bump_generation
+from .writer import DBWriter
 
 
 __all__ = (
     "DB",
-    "Model"
+    "Model",
+    "engine_profiles",
 )
 
 
+T = TypeVar("T")
+
+
 @as_declarative()
 class Model:
     id = Column(Integer, primary_key=True, unique=True)
@@ -24,35 +35,195 @@ class Model:
 class _DB_Meta(type):
     _instances: ClassVar[Dict[str, _DB]] = {}  # noqa: F821
 
-    def __call__(cls, engine_descriptor=None):
+    def __call__(cls, engine_descriptor=None, profile="read"):
         if engine_descriptor in _DB_Meta._instances:
-            return _DB_Meta._instances[engine_descriptor]
+            instance = _DB_Meta._instances[engine_descriptor]
+            # one instance per url, so that there is a single writer and in-memory DBs are shared,
+            # its default profile can only be changed explicitly via `configure`
+            if profile != instance.profile:
+                raise ValueError(f"DB {engine_descriptor} is already configured with the profile {instance.profile!r}, not {profile!r}")
+            return instance
         else:
-            _DB_Meta._instances[engine_descriptor] = instance = super().__call__(engine_descriptor)
+            _DB_Meta._instances[engine_descriptor] = instance = super().__call__(engine_descriptor, profile)
             return instance
 
 
+# pragmas applied to every new SQLite connection, WAL journaling lets readers
+# proceed while a write transaction is open
+engine_profiles: Dict[str, Dict[str, Any]] = {
+    # many small read transactions, e.g. the UI and the queries of the CLI
+    "read": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -64 * 1024,  # in KiB
+        "mmap_size": 1024 ** 3,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,  # in ms
+    },
+    # few large write transactions, e.g. downloads and imports
+    "ingest": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -256 * 1024,  # in KiB
+        "mmap_size": 256 * 1024 ** 2,
+        "temp_store": "MEMORY",
+        "wal_autocheckpoint": 10000,
+        "busy_timeout": 30000,  # in ms
+    },
+}
+
+# options of the engines of the profiles, readers share a pool of connections
+# across threads, while writes get a fresh connection
+engine_options: Dict[str, Dict[str, Any]] = {
+    "read": {
+        "poolclass": QueuePool,
+        "pool_size": 8,
+        "max_overflow": 8,
+        "connect_args": {"check_same_thread": False},
+    },
+    "ingest": {},
+}
+
+
+def _set_pragmas(pragmas: Dict[str, Any]) -> Callable[[Any, Any], None]:
+    def on_connect(dbapi_connection: Any, connection_record: Any) -> None:
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+    return on_connect
+
+
+def _guard_fork(engine: Engine) -> None:
+    # pooled connections must not be shared with forked processes, e.g. the model builders of the UI,
+    # see "Using Connection Pools with Multiprocessing" in the SQLAlchemy docs
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection: Any, connection_record: Any) -> None:
+        connection_record.info["pid"] = os.getpid()
+
+    @event.listens_for(engine, "checkout")
+    def checkout(dbapi_connection: Any, connection_record: Any, connection_proxy: Any) -> None:
+        if connection_record.info["pid"] != os.getpid():
+            connection_record.connection = connection_proxy.connection = None
+            raise exc.DisconnectionError("Connection belongs to another process.")
+
+
 class _DB(metaclass=_DB_Meta):
-    def __init__(self, engine_descriptor: str) -> None:
-        self.configure(engine_descriptor)
+    def __init__(self, engine_descriptor: str, profile: str = "read") -> None:
+        self.configure(engine_descriptor, profile)
 
-    def configure(self, engine_descriptor: str) -> None:
+    def configure(self, engine_descriptor: str, profile: str = "read") -> None:
+        """(Re)configure the engines of the DB
+
+        :param engine_descriptor: url of the DB
+        :param profile: name of the engine profile used by default (default: "read")
+
+        """
         if hasattr(self, "_engine"):
+            if self._writer is not None:
+                self._writer.close()
             del self._ScopedSession
             del self._Session
             del self._engine
-        self._engine: Engine = create_engine(engine_descriptor)
+        self._engine_descriptor = engine_descriptor
+        self._profile = profile
+        self._engines: Dict[str, Engine] = {}
+        self._engine: Engine = self.get_engine(profile)
         self._Session: Type[Session] = sessionmaker(bind=self._engine)
         self._ScopedSession: Type[Session] = scoped_session(self._Session)
-
-    def create_tables(self) -> None:
+        self._writer: Optional[DBWriter] = None
+
+    @property
+    def engine(self) -> Engine:
+        return self._engine
+
+    @property
+    def profile(self) -> str:
+        """Name of the engine profile used by default"""
+        return self._profile
+
+    def get_engine(self, profile: Optional[str] = None) -> Engine:
+        """Get the engine of an engine profile, see `engine_profiles`
+
+        Every profile has an engine of its own, except for in-memory DBs,
+        which are shared by all profiles and threads.
+
+        :param profile: name of the engine profile (default: None, i.e. the default profile)
+
+        """
+        if profile is None:
+            return self._engine
+        elif profile not in self._engines:
+            in_memory = make_url(self._engine_descriptor).database in (None, "", ":memory:")
+            if self._engines and in_memory:
+                return self._engine
+            elif in_memory:
+                engine = create_engine(self._engine_descriptor, poolclass=StaticPool, connect_args={"check_same_thread": False})
+            elif make_url(self._engine_descriptor).get_backend_name() == "sqlite":
+                engine = create_engine(self._engine_descriptor, **engine_options[profile])
+                _guard_fork(engine)
+            else:
+                engine = create_engine(self._engine_descriptor)
+            if engine.dialect.name == "sqlite":
+                event.listen(engine, "connect", _set_pragmas(engine_profiles[profile]))
+            self._engines[profile] = engine
+        return self._engines[profile]
+
+    def create_tables(self) -> List[Migration]:
+        """Create all missing tables and migrate the existing ones, see `migrate`
+
+        :return: the applied migrations
+
+        """
+        fresh = not set(inspect(self._engine).get_table_names()) & set(Model.metadata.tables)  # type: ignore
         Model.metadata.create_all(self._engine)  # type: ignore
+        generation_table.create(self._engine, checkfirst=True)
+        return migrate(self._engine, Model.metadata, fresh)  # type: ignore
 
     def drop_tables(self) -> None:
         Model.metadata.drop_all(self._engine)  # type: ignore
+        # the dropped data may still be cached, see `db.cache`
+        generation_table.create(self._engine, checkfirst=True)
+        with self._engine.begin() as connection:
+            bump_generation(connection)
+
+    @property
+    def writer(self) -> DBWriter:
+        """The single writer of the DB, which uses the "ingest" engine profile, see `write`"""
+        if self._writer is None:
+            self._writer = DBWriter(sessionmaker(bind=self.get_engine("ingest")))
+        return self._writer
+
+    def write(self, func: Callable[[Session], T]) -> Future[T]:
+        """Run a write transaction on the writer thread, see `DBWriter`
+
+        Use this instead of `get_session` for writes that may run concurrently
+        with other writes, e.g. in the UI.
+
+        :param func: function doing the write in the given session
+        :returns: future of the result of the function
+
+        """
+        return self.writer.submit(func)
+
+    @contextmanager
+    def read_session(self) -> Generator[Session, None, None]:
+        """Get a session for reading only, from the pooled "read" engine profile
+
+        Changes made in the session are always rolled back.
+
+        """
+        session = self._Session(bind=self.get_engine("read"))
+        try:
+            yield session
+        finally:
+            session.rollback()
+            session.close()
 
     @contextmanager
-    def get_session(self, *args, scoped: bool = False, **kwargs) -> Generator[Session, None, None]:
+    def get_session(self, *args, scoped: bool = False, profile: Optional[str] = None, **kwargs) -> Generator[Session, None, None]:
+        if profile is not None:
+            kwargs["bind"] = self.get_engine(profile)
         session = self._Session(*args, **kwargs) if not scoped else self._ScopedSession(*args, **kwargs)
         try:
             yield session
@@ -70,4 +241,5 @@ class _DB(metaclass=_DB_Meta):
 
 project_dir = os.getcwd()
 database_path = os.path.join(project_dir, "db.sqlite3")
-DB = _DB(f"sqlite:///{database_path}")
+# the DB and the default engine profile can be overridden via the environment
+DB = _DB(os.environ.get("DFB_DATABASE_URL", f"sqlite:///{database_path}"), os.environ.get("DFB_DB_PROFILE", "read"))
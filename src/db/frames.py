@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import List, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+
+from .models import Match, Group, Season, Team, matchday_key
+from .selectors import RangeSelector
+from .cache import query_cache, current_generation
+
+
+__all__ = (
+    "MatchFrame",
+    "load_match_frame",
+    "extend_match_frame",
+)
+
+
+@dataclass(frozen=True)
+class MatchFrame:
+    """Finished matches as contiguous columns
+
+    Teams are integer coded, `teams` and `team_ids` map the codes
+    onto the names and ids of the teams.
+    """
+    host: np.ndarray
+    guest: np.ndarray
+    host_goals: np.ndarray
+    guest_goals: np.ndarray
+    date: np.ndarray
+    season: np.ndarray
+    group: np.ndarray
+
+    teams: List[str]
+    team_ids: np.ndarray
+
+    # data generation the matches were loaded at, see `db.cache`
+    generation: Optional[int] = None
+
+    def __post_init__(self) -> None:
+        # frames are shared by the query cache
+        for column in (self.host, self.guest, self.host_goals, self.guest_goals, self.date, self.season, self.group, self.team_ids):
+            column.flags.writeable = False
+
+    def __len__(self) -> int:
+        return len(self.host)
+
+    @property
+    def matchday_key(self) -> np.ndarray:
+        """Matchday keys of the matches, see `models.matchday_key`"""
+        return matchday_key(self.season, self.group)
+
+    def to_frame(self) -> pd.DataFrame:
+        """Convert the columns into a DataFrame, with one row per match"""
+        return pd.DataFrame({
+            "host": self.host,
+            "guest": self.guest,
+            "host_goals": self.host_goals,
+            "guest_goals": self.guest_goals,
+            "date": self.date,
+            "season": self.season,
+            "group": self.group,
+        })
+
+
+@query_cache.cached("match_frame")
+def load_match_frame(selector: RangeSelector, session: Session) -> MatchFrame:
+    """Load the finished matches in the selected timespace as columns
+
+    The matches are loaded by a single select of plain columns, without
+    creating any ORM instances, and the names of the teams by a second one.
+    The frame is cached until the next change of the data, see `query_cache`.
+
+    :param selector: selection of the matches
+    :param session: DB session to interact with
+
+    """
+    rows = session.execute(
+        select([
+            Match.host_team_id, Match.guest_team_id, Match.host_points, Match.guest_points, Match.date, Season.year, Group.order_id,
+        ]).select_from(
+            Match.__table__.join(Group.__table__).join(Season.__table__)
+        ).where(
+            Match.is_finished
+        ).where(
+            selector.build_filters()
+        ).order_by(Match.date, Match.id)
+    ).fetchall()
+    columns = pd.DataFrame.from_records(
+        rows, columns=["host", "guest", "host_goals", "guest_goals", "date", "season", "group"], coerce_float=False
+    )
+
+    generation = current_generation(session)
+    host, guest = np.asarray(columns["host"].values, dtype=np.int64), np.asarray(columns["guest"].values, dtype=np.int64)
+    names = dict(session.query(Team.id, Team.name).filter(Team.id.in_(np.union1d(host, guest).tolist())))
+
+    return _coded_frame(
+        host, guest,
+        np.asarray(columns["host_goals"].values, dtype=np.int64),
+        np.asarray(columns["guest_goals"].values, dtype=np.int64),
+        np.asarray(columns["date"].values, dtype="datetime64[s]"),
+        np.asarray(columns["season"].values, dtype=np.int64),
+        np.asarray(columns["group"].values, dtype=np.int64),
+        names,
+        generation,
+    )
+
+
+def extend_match_frame(frame: MatchFrame, previous: RangeSelector, selector: RangeSelector, session: Session) -> MatchFrame:
+    """Load the finished matches in the selected timespace, reusing a frame of a previous selection
+
+    Only the matches from the last matchday (or season) of the previous selection onwards are
+    loaded, thus matches finished later on that matchday are picked up too. Matches before the
+    start of the selection are dropped. If the selection isn't a later or shifted version of
+    the previous one, e.g. it starts earlier or the previous one has no end, everything is loaded.
+
+    If the data changed since the previous frame was loaded, the reused matches are checked
+    against a fingerprint of their counterparts in the DB, i.e. their count and sums of their
+    goals and teams, and everything is loaded if e.g. a result was corrected by a sync.
+
+    :param frame: frame of the previous selection
+    :param previous: the previous selection
+    :param selector: selection of the matches
+    :param session: DB session to interact with
+
+    """
+    previous_lower, previous_upper = previous.start.bound(False), previous.end.bound(True)
+    lower, upper = selector.start.bound(False), selector.end.bound(True)
+    if (
+        previous_upper is None or  # noqa: W504
+        (upper is not None and upper < previous_upper) or  # noqa: W504
+        (previous_lower is not None and (lower is None or lower < previous_lower))
+    ):
+        return load_match_frame(selector, session)
+
+    reload_from = previous.end.bound(False)
+    if lower is not None and lower > reload_from:
+        added = load_match_frame(selector, session)
+    else:
+        added = load_match_frame(RangeSelector(previous.end, selector.end), session)
+    keys = frame.matchday_key
+    kept = keys < reload_from
+    if lower is not None:
+        kept &= keys >= lower
+    if frame.generation is None or frame.generation != added.generation:
+        kept_fingerprint = _fingerprint(frame.team_ids[frame.host][kept], frame.team_ids[frame.guest][kept], frame.host_goals[kept], frame.guest_goals[kept])
+        if kept_fingerprint != _stored_fingerprint(session, lower, reload_from):
+            return load_match_frame(selector, session)
+
+    names = {**dict(zip(frame.team_ids.tolist(), frame.teams)), **dict(zip(added.team_ids.tolist(), added.teams))}
+    return _coded_frame(*(
+        np.concatenate([old[kept], new])
+        for old, new in (
+            (frame.team_ids[frame.host], added.team_ids[added.host]),
+            (frame.team_ids[frame.guest], added.team_ids[added.guest]),
+            (frame.host_goals, added.host_goals),
+            (frame.guest_goals, added.guest_goals),
+            (frame.date, added.date),
+            (frame.season, added.season),
+            (frame.group, added.group),
+        )
+    ), names, added.generation)
+
+
+def _stored_fingerprint(session: Session, lower: Optional[int], upper: int) -> Tuple[int, ...]:
+    host, guest, host_goals, guest_goals = Match.host_team_id, Match.guest_team_id, Match.host_points, Match.guest_points
+    query = select([
+        func.count(), func.sum(host_goals), func.sum(guest_goals),
+        func.sum(host * (host_goals + 1)), func.sum(guest * (guest_goals + 1)), func.sum(host * guest),
+    ]).select_from(
+        Match.__table__.join(Group.__table__)
+    ).where(Match.is_finished).where(Group.matchday_key < upper)
+    if lower is not None:
+        query = query.where(Group.matchday_key >= lower)
+    return tuple(int(value or 0) for value in session.execute(query).first())
+
+
+def _fingerprint(host: np.ndarray, guest: np.ndarray, host_goals: np.ndarray, guest_goals: np.ndarray) -> Tuple[int, ...]:
+    # insensitive to the order of the matches, sensitive to changed results and teams, see `_stored_fingerprint`
+    return (
+        len(host), int(host_goals.sum()), int(guest_goals.sum()),
+        int(np.dot(host, host_goals + 1)), int(np.dot(guest, guest_goals + 1)), int(np.dot(host, guest)),
+    )
+
+
+def _coded_frame(
+    host: np.ndarray, guest: np.ndarray, host_goals: np.ndarray, guest_goals: np.ndarray,
+    date: np.ndarray, season: np.ndarray, group: np.ndarray, names: Dict[int, str], generation: Optional[int] = None,
+) -> MatchFrame:
+    # integer codes the teams, given their ids
+    team_ids, codes = np.unique(np.concatenate([host, guest]), return_inverse=True)
+    return MatchFrame(
+        host=codes[:len(host)],
+        guest=codes[len(host):],
+        host_goals=host_goals,
+        guest_goals=guest_goals,
+        date=date,
+        season=season,
+        group=group,
+        teams=[names[team_id] for team_id in team_ids.tolist()],
+        team_ids=team_ids,
+        generation=generation,
+    )
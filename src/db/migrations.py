@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, List, Set
+
+from sqlalchemy import MetaData, Table, Column, Integer, String, DateTime, inspect, select, and_
+from sqlalchemy.engine.base import Engine, Connection
+
+from .cache import bump_generation
+
+
+__all__ = (
+    "Migration",
+    "migration",
+    "migrate",
+)
+
+
+# kept apart from the metadata of the models, so the applied migrations survive dropping all tables
+migrations_table = Table(
+    "schema_migrations", MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String),
+    Column("applied_at", DateTime, default=datetime.utcnow),
+)
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    apply: Callable[[Connection, MetaData], None]
+
+
+migrations: List[Migration] = []
+
+
+def migration(version: int, name: str) -> Callable[[Callable[[Connection, MetaData], None]], Callable[[Connection, MetaData], None]]:
+    """Decorator, which registers a function migrating an existing DB to a newer schema.
+
+    The function receives the connection to migrate, within a transaction, and the
+    metadata of the models. Migrations are applied in the order of their versions.
+
+    :param version: version of the schema after the migration, strictly increasing
+    :param name: short description of the migration
+
+    """
+    def decorator(func: Callable[[Connection, MetaData], None]) -> Callable[[Connection, MetaData], None]:
+        if migrations and migrations[-1].version >= version:
+            raise ValueError(f"Migration {version} must come after migration {migrations[-1].version}.")
+        migrations.append(Migration(version, name, func))
+        return func
+    return decorator
+
+
+def applied_versions(connection: Connection) -> Set[int]:
+    return {version for (version,) in connection.execute(select([migrations_table.c.version]))}
+
+
+def migrate(engine: Engine, metadata: MetaData, fresh: bool = False) -> List[Migration]:
+    """Apply all pending migrations, each in a transaction of its own
+
+    Tables created by `create_all` already have the latest schema, thus the
+    migrations of a fresh DB are merely recorded as applied.
+
+    :param engine: engine of the DB to migrate
+    :param metadata: metadata of the models
+    :param fresh: whether all tables were just created (default value = False)
+    :return: the applied migrations
+
+    """
+    migrations_table.create(engine, checkfirst=True)
+    applied = []
+    with engine.connect() as connection:
+        versions = applied_versions(connection)
+        for pending in migrations:
+            if pending.version in versions:
+                continue
+            with connection.begin():
+                if not fresh:
+                    pending.apply(connection, metadata)
+                connection.execute(migrations_table.insert().values(version=pending.version, name=pending.name))
+            applied.append(pending)
+    return applied
+
+
+@migration(1, "add indexes on foreign keys and filtered columns")
+def _create_missing_indexes(connection: Connection, metadata: MetaData) -> None:
+    # indexes on columns added by later migrations are created by those
+    inspector = inspect(connection)
+    existing_tables = set(inspector.get_table_names())
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing and all(column.name in existing_columns for column in index.columns):
+                index.create(connection)
+
+
+@migration(2, "add host and guest team ids to matches")
+def _add_host_and_guest_team_ids(connection: Connection, metadata: MetaData) -> None:
+    matches, participations = metadata.tables["matches"], metadata.tables["match_participations"]
+    existing_columns = {column["name"] for column in inspect(connection).get_columns("matches")}
+    for column in (matches.c.host_team_id, matches.c.guest_team_id):
+        if column.name not in existing_columns:
+            connection.execute(f"ALTER TABLE matches ADD COLUMN {column.name} INTEGER REFERENCES teams (id)")
+    _create_missing_indexes(connection, metadata)
+
+    connection.execute(matches.update().values({
+        column: select([participations.c.team_id]).where(and_(
+            participations.c.match_id == matches.c.id,
+            participations.c.hosted == hosted,
+        )).limit(1).as_scalar()
+        for column, hosted in ((matches.c.host_team_id, True), (matches.c.guest_team_id, False))
+    }))
+    bump_generation(connection)
+
+
+@migration(3, "add matchday keys to groups")
+def _add_matchday_keys(connection: Connection, metadata: MetaData) -> None:
+    groups, seasons = metadata.tables["groups"], metadata.tables["seasons"]
+    if "matchday_key" not in {column["name"] for column in inspect(connection).get_columns("groups")}:
+        connection.execute("ALTER TABLE groups ADD COLUMN matchday_key INTEGER")
+    _create_missing_indexes(connection, metadata)
+
+    # see models.matchday_key
+    connection.execute(groups.update().values(
+        matchday_key=select([seasons.c.year * 100 + groups.c.order_id]).where(seasons.c.id == groups.c.season_id).as_scalar()
+    ))
+    bump_generation(connection)
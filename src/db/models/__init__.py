@@ -3,6 +3,7 @@ from .association_tables import *
 from .team import *
 from .match import *
 from .group import *
+from .checkpoint import *
 
 
-__all__ = season.__all__ + team.__all__ + association_tables.__all__ + match.__all__ + group.__all__
+__all__ = season.__all__ + team.__all__ + association_tables.__all__ + match.__all__ + group.__all__ + checkpoint.__all__
@@ -12,18 +12,18 @@ __all__ = (
 
 team_season_association_table = Table(
     "team_seasons_association", Model.metadata,  # type: ignore
-    Column("season_id", Integer, ForeignKey("seasons.id")),
-    Column("team_id", Integer, ForeignKey("teams.id")),
+    Column("season_id", Integer, ForeignKey("seasons.id"), index=True),
+    Column("team_id", Integer, ForeignKey("teams.id"), index=True),
 )
 
 
 class MatchParticipation(Model):
     __tablename__ = "match_participations"
 
-    team_id = Column(Integer, ForeignKey("teams.id"))
+    team_id = Column(Integer, ForeignKey("teams.id"), index=True)
     team = relationship("Team", backref="match_participations")
 
-    match_id = Column(Integer, ForeignKey("matches.id"))
+    match_id = Column(Integer, ForeignKey("matches.id"), index=True)
     match = relationship("Match", backref="match_participations")
 
     hosted = Column(Boolean)
@@ -0,0 +1,22 @@
+from datetime import datetime
+
+from sqlalchemy import Column, Integer, DateTime
+
+from ..core import Model
+
+
+__all__ = (
+    "IngestCheckpoint",
+)
+
+
+class IngestCheckpoint(Model):
+    """Marks a group, or a whole season if there is no group order id, as completely ingested"""
+    __tablename__ = "ingest_checkpoints"
+
+    year = Column(Integer, nullable=False, index=True)
+    group_order_id = Column(Integer)
+    completed_at = Column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<IngestCheckpoint(year={self.year}, group_order_id={self.group_order_id})>"
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, ForeignKey
+from sqlalchemy import Column, Integer, ForeignKey, event
 from sqlalchemy.orm import relationship
 
 from ..core import Model
@@ -6,15 +6,23 @@ from ..core import Model
 
 __all__ = (
     "Group",
+    "matchday_key",
 )
 
 
+def matchday_key(year: int, order_id: int) -> int:
+    """Get the key of a matchday, which orders matchdays by season and order id"""
+    return year * 100 + order_id
+
+
 class Group(Model):
     __tablename__ = "groups"
 
-    order_id = Column(Integer)
+    order_id = Column(Integer, index=True)
+    # denormalised matchday_key(season.year, order_id), lets selections be a single range scan
+    matchday_key = Column(Integer, index=True)
 
-    season_id = Column(ForeignKey("seasons.id"))
+    season_id = Column(ForeignKey("seasons.id"), index=True)
     season = relationship("Season", backref="groups")
 
     def __repr__(self):
@@ -22,3 +30,10 @@ class Group(Model):
 
     def __str__(self):
         return f"{self.order_id}-ter Spieltag {str(self.season)}"
+
+
+@event.listens_for(Group, "before_insert")
+@event.listens_for(Group, "before_update")
+def _update_matchday_key(mapper, connection, group: Group) -> None:
+    season = group.season
+    group.matchday_key = matchday_key(season.year, group.order_id) if season is not None and group.order_id is not None else None
@@ -13,21 +13,19 @@ class Match(Model):
     __tablename__ = "matches"
 
     date = Column(DateTime)
-    is_finished = Column(Boolean)
+    is_finished = Column(Boolean, index=True)
 
-    group_id = Column(Integer, ForeignKey("groups.id"))
+    group_id = Column(Integer, ForeignKey("groups.id"), index=True)
     group = relationship("Group", backref="matches")
 
-    host_points = Column(Integer)
-    guest_points = Column(Integer)
+    host_team_id = Column(Integer, ForeignKey("teams.id"), index=True)
+    host = relationship("Team", foreign_keys=[host_team_id])
 
-    @property
-    def host(self):
-        return [part.team for part in self.match_participations if part.hosted][0]
+    guest_team_id = Column(Integer, ForeignKey("teams.id"), index=True)
+    guest = relationship("Team", foreign_keys=[guest_team_id])
 
-    @property
-    def guest(self):
-        return [part.team for part in self.match_participations if not part.hosted][0]
+    host_points = Column(Integer)
+    guest_points = Column(Integer)
 
     def __repr__(self) -> str:
         return f"<Match(datetime={self.date}, host={str(self.host)}, guest={str(self.guest)}, host_points={self.host_points}, guest_points={self.guest_points})>"
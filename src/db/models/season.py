@@ -13,7 +13,7 @@ __all__ = (
 class Season(Model):
     __tablename__ = "seasons"
 
-    year = Column(Integer)
+    year = Column(Integer, index=True)
     enabled = Column(Boolean, default=True)
 
     teams = relationship("Team", secondary=team_season_association_table, back_populates="seasons")
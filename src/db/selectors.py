@@ -1,21 +1,30 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import Optional
+from typing import Optional, List, Any, Tuple
 
-from sqlalchemy import and_, or_
-from sqlalchemy.orm import Query
+from sqlalchemy import and_
+from sqlalchemy.orm import Query, Session, joinedload, selectinload, contains_eager
 
-from .models import Group, Season, Match, Team, MatchParticipation
+from .models import Group, Season, Match, Team, MatchParticipation, matchday_key
+from .cache import query_cache
 
 
 __all__ = (
     "RangeSelector",
-    "RangePoint"
+    "RangePoint",
+    "season_years",
 )
 
 
-@dataclass
+# loader strategies which can be used to eagerly load the relationships of selected instances
+loader_strategies = {
+    "joined": joinedload,
+    "selectin": selectinload,
+}
+
+
+@dataclass(frozen=True)
 class RangePoint:
     """Edge of a selection"""
     year: Optional[int] = None
@@ -45,19 +54,21 @@ class RangePoint:
     def __str__(self):
         return f"{self.year}{f'/{self.group}' if self.group is not None else ''}"
 
-    def build_filter(self, compare_op: str, *, ignore_groups: bool = False):
-        if not self.is_null():
-            if not self.is_partial() and not ignore_groups:
-                return or_(
-                    getattr(Season.year, f"__{compare_op}t__")(self.year),
-                    and_(
-                        Season.year == self.year,
-                        getattr(Group.order_id, f"__{compare_op}e__")(self.group)
-                    )
-                )
-            elif self.year is not None:
-                return getattr(Season.year, f"__{compare_op}e__")(self.year)
-        return and_()
+    def bound(self, upper: bool, *, ignore_groups: bool = False) -> Optional[int]:
+        """Get the bound of a selection with this edge, see `RangeSelector.build_filters`
+
+        :param upper: whether this is the upper edge of the selection
+        :param ignore_groups: whether to bound the year only (default: False)
+        :returns: the year or matchday key of the bound, None if unbounded
+
+        """
+        if self.year is None:
+            return None
+        elif ignore_groups:
+            return self.year
+        elif self.group is None:
+            return matchday_key(self.year, 99 if upper else 0)
+        return matchday_key(self.year, self.group)
 
 
 class RangeSelector:
@@ -70,6 +81,9 @@ class RangeSelector:
     def __neq__(self, other: RangePoint) -> bool:
         return not isinstance(other, RangeSelector) or self._start != other._start or self._end != other._end
 
+    def __hash__(self) -> int:
+        return hash(self.key)
+
     def __init__(self, start: Optional[RangePoint] = None, end: Optional[RangePoint] = None) -> None:
         self._start = start or RangePoint()
         self._end = end or RangePoint()
@@ -90,6 +104,11 @@ class RangeSelector:
         else:
             return str(self._start)
 
+    @property
+    def key(self) -> Tuple[RangePoint, RangePoint]:
+        """Hashable snapshot of the selection, which is not affected by `copy`"""
+        return self._start, self._end
+
     @property
     def start(self):
         return self._start
@@ -114,16 +133,70 @@ class RangeSelector:
         self._end = other._end
 
     def build_filters(self, *, ignore_groups: bool = False):
-        """Build a filter to match data in timespace."""
-        return and_(
-            self._start.build_filter("g", ignore_groups=ignore_groups),
-            self._end.build_filter("l", ignore_groups=ignore_groups)
-        )
+        """Build a filter to match data in timespace.
+
+        The filter is a single range of `Group.matchday_key`, or of `Season.year` if groups are ignored.
+
+        """
+        column = Season.year if ignore_groups else Group.matchday_key
+        lower = self._start.bound(False, ignore_groups=ignore_groups)
+        upper = self._end.bound(True, ignore_groups=ignore_groups)
+        if lower is not None and upper is not None:
+            return column.between(lower, upper)
+        elif lower is not None:
+            return column >= lower
+        elif upper is not None:
+            return column <= upper
+        return and_()
+
+    def build_team_query(self, *, ignore_groups: bool = False, load: Optional[str] = None) -> Query:
+        """Build a query for Teams with matches in selected timespace.
+
+        :param load: loader strategy of the seasons of the teams, see `loader_strategies` (default: None, i.e. lazy loading)
+
+        """
+        query = Query(Team).join(Team.seasons, Team.match_participations, MatchParticipation.match, Match.group).filter(Match.is_finished, self.build_filters(ignore_groups=ignore_groups))
+        if load is not None:
+            query = query.options(loader_strategies[load](Team.seasons))
+        return query
+
+    def build_match_query(self, *, ignore_groups: bool = False, load: Optional[str] = None) -> Query:
+        """Build a query for Matches in selected timespace.
+
+        :param load: loader strategy of the host and guest of the matches, see `match_load_options` (default: None, i.e. lazy loading)
+
+        """
+        query = Query(Match).join(Match.group, Group.season).filter(Match.is_finished, self.build_filters(ignore_groups=ignore_groups))
+        if load is not None:
+            query = query.options(*self.match_load_options(load))
+        return query
+
+    @staticmethod
+    def match_load_options(load: str) -> List[Any]:
+        """Build the options to eagerly load everything needed to display matches
+
+        Group and season are taken from the joins of the query, thus the query has
+        to join Match.group and Group.season, like `build_match_query` does.
+
+        :param load: loader strategy of the host and guest, see `loader_strategies`
+
+        """
+        strategy = loader_strategies[load]
+        return [
+            contains_eager(Match.group).contains_eager(Group.season),
+            strategy(Match.host),
+            strategy(Match.guest),
+        ]
+
+
+@query_cache.cached("season_years")
+def season_years(selector: RangeSelector, session: Session) -> List[int]:
+    """Get the years of the seasons in the selected timespace, in ascending order
+
+    The result is cached, see `query_cache`, thus it must not be mutated.
 
-    def build_team_query(self, *, ignore_groups: bool = False) -> Query:
-        """Build a query for Teams with matches in selected timespace."""
-        return Query(Team).join(Team.seasons, Team.match_participations, MatchParticipation.match, Match.group).filter(Match.is_finished, self.build_filters(ignore_groups=ignore_groups))
+    :param selector: selection of the seasons, groups are ignored
+    :param session: DB session to interact with
 
-    def build_match_query(self, *, ignore_groups: bool = False) -> Query:
-        """Build a query for Matches in selected timespace."""
-        return Query(Match).join(Match.group, Group.season).filter(Match.is_finished, self.build_filters(ignore_groups=ignore_groups))
+    """
+    return [year for (year,) in session.query(Season.year).filter(selector.build_filters(ignore_groups=True)).order_by(Season.year)]
@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+from concurrent.futures import Future
+from queue import Queue
+from threading import Thread, Lock, current_thread
+from typing import Callable, Optional, TypeVar, Any
+
+from sqlalchemy.orm import Session
+
+
+__all__ = (
+    "DBWriter",
+)
+
+
+T = TypeVar("T")
+
+
+class DBWriter:
+    """Single thread owning all write transactions of a DB
+
+    Writes are submitted as functions of a session, which are run one after
+    another, each in a session and transaction of its own. The transaction is
+    committed if the function returns and rolled back if it raises. Since there
+    is only ever one writer, writers never wait for each other's locks, and
+    readers don't block on writers thanks to WAL journaling.
+    """
+    def __init__(self, session_factory: Callable[[], Session]) -> None:
+        self._session_factory = session_factory
+        self._queue: Queue = Queue()
+        self._thread: Optional[Thread] = None
+        self._lock = Lock()
+
+    @property
+    def in_writer_thread(self) -> bool:
+        return self._thread is current_thread()
+
+    def submit(self, func: Callable[[Session], T]) -> Future[T]:
+        """Submit a write to the writer thread, the thread is started on the first write
+
+        :param func: function doing the write in the given session, its result is the result of the future
+        :returns: future of the result of the function
+
+        """
+        if self.in_writer_thread:
+            raise RuntimeError("Writes can't be submitted by a write, it would wait on itself.")
+        future: Future[T] = Future()
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+            self._queue.put((future, func))
+        return future
+
+    def close(self) -> None:
+        """Finish all submitted writes and stop the writer thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is not None:
+                self._queue.put(None)
+        if thread is not None:
+            thread.join()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            future, func = item
+            if future.set_running_or_notify_cancel():
+                self._write(future, func)
+
+    def _write(self, future: Future, func: Callable[[Session], Any]) -> None:
+        session = self._session_factory()
+        try:
+            result = func(session)
+            session.commit()
+        except BaseException as e:
+            session.rollback()
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+        finally:
+            session.close()
@@ -2,11 +2,13 @@ from __future__ import annotations
 
 from abc import ABCMeta, abstractmethod, abstractstaticmethod
 from dataclasses import dataclass, InitVar, field
-from typing import Optional, Type, ClassVar, Dict, Any, TypeVar, List, Tuple
+from typing import Optional, Type, ClassVar, Dict, Any, TypeVar, List, Tuple, Sequence
+
+import numpy as np
 
 from sqlalchemy.orm import Session
 
-from ..db import RangeSelector, RangePoint
+from ..db import RangeSelector, RangePoint, MatchFrame, load_match_frame, extend_match_frame
 
 
 __all__ = (
@@ -17,6 +19,30 @@ __all__ = (
 T = TypeVar('T')
 
 
+def collapse_rows(columns: Sequence[np.ndarray], weights: Optional[np.ndarray] = None) -> Tuple[List[np.ndarray], np.ndarray]:
+    """Collapse identical rows into single rows, weighted by the sum of their weights
+
+    Likelihoods which are weighted sums over the rows are unchanged by this, while
+    they have to be evaluated once per distinct row only.
+
+    :param columns: integer columns of the rows
+    :param weights: weights of the rows (default value = None, i.e. all ones)
+    :returns: the columns of the distinct rows and their weights
+
+    """
+    columns = [np.asarray(column, dtype=np.int64) for column in columns]
+    offsets = [column.min(initial=0) for column in columns]
+    dims = [int(column.max(initial=0) - offset) + 1 for column, offset in zip(columns, offsets)]
+    if np.prod(np.array(dims, dtype=np.float64)) < 2 ** 62:
+        # a single integer key per row is way faster to make unique than the rows themselves
+        keys, inverse = np.unique(np.ravel_multi_index([column - offset for column, offset in zip(columns, offsets)], dims), return_inverse=True)
+        rows = [row + offset for row, offset in zip(np.unravel_index(keys, dims), offsets)]
+    else:
+        unique_rows, inverse = np.unique(np.stack(columns, axis=1), axis=0, return_inverse=True)
+        rows = list(unique_rows.T)
+    return rows, np.bincount(inverse.reshape(-1), weights, minlength=len(rows[0])).astype(np.float64)
+
+
 @dataclass(frozen=True)
 class PredictionResult:
     selector: RangeSelector
@@ -70,19 +96,54 @@ class Model(metaclass=ABCMeta):
 
     selector: RangeSelector
     session: InitVar[Session]
+    previous: InitVar[Optional[Model]] = None
 
     features: Any = field(init=False)
     teams: List[str] = field(init=False)
+    frame: MatchFrame = field(init=False, repr=False)
 
     def __init_subclass__(cls, verbose_name: Optional[str] = None) -> None:
         cls.verbose_name = verbose_name or cls.__name__
         Model.registry[cls.verbose_name] = cls
 
-    def __post_init__(self, session: Session) -> None:
-        self.features, self.teams = self.calculate_model(self.selector, session)
+    def __post_init__(self, session: Session, previous: Optional[Model] = None) -> None:
+        # models pickled by earlier versions have no frame, they are fitted from scratch
+        if previous is not None and type(previous) is type(self) and getattr(previous, "frame", None) is not None:
+            self.frame = extend_match_frame(previous.frame, previous.selector, self.selector, session)
+            warm_start = previous.features
+        else:
+            self.frame = load_match_frame(self.selector, session)
+            warm_start = None
+        if len(self.frame) == 0:
+            raise RuntimeError("Couldn't rebuild model, no matches for given selector...")
+        self.features, self.teams = self.calculate_model(self.frame, warm_start)
+
+    @classmethod
+    def refit(cls: Type[T], selector: RangeSelector, session: Session, previous: Model) -> T:
+        """Fit a model to a new selection, starting from a previous model
+
+        The matches of the previous model are reused, thus only the matches added since the
+        end of the previous selection are loaded, and its features are the starting point of
+        the fit. This is way cheaper than a new model, e.g. after every matchday.
+
+        :param selector: selection of the matches
+        :param session: DB session to interact with
+        :param previous: model of a previous selection, usually ending earlier
+        :returns: the new model, of the type of the previous model if called on `Model`
+
+        """
+        model_class = type(previous) if cls is Model else cls
+        return model_class(selector, session, previous)  # type: ignore
 
     @abstractstaticmethod
-    def calculate_model(selector: RangeSelector, session: Session) -> Tuple[Any, List[str]]:
+    def calculate_model(frame: MatchFrame, warm_start: Optional[Any] = None) -> Tuple[Any, List[str]]:
+        """Fit the model to the selected matches
+
+        :param frame: the selected matches
+        :param warm_start: features of a previous fit, to start the fit from (default value = None)
+        :returns: the features of the model and its teams
+
+        """
         raise NotImplementedError()
 
     @abstractmethod
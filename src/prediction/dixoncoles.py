@@ -1,83 +1,115 @@
 from __future__ import annotations
-from typing import Dict
-import json
+from dataclasses import dataclass
+from typing import Dict, Tuple, List, Optional
+import warnings
 
-import pandas as pd
 import numpy as np
 from scipy.stats import poisson
+from scipy.special import gammaln
 from scipy.optimize import minimize
-from sqlalchemy.orm import Session
-from sqlalchemy import func
 
-from ..db import RangeSelector, Match
-from .base import Model
+from ..db import MatchFrame
+from .base import Model, collapse_rows
 from .poisson import PoissonResult
 
 
 __all__ = (
     "DixonColesModel",
+    "DixonColesFeatures",
 )
 
 
+# decay of the weights of matches per day of their age
+time_decay = 0.001
+
+# keeps the score correction of every low scoring result positive for any sensible expected goals
+score_correction_bounds = (-0.3, 0.3)
+
+
+@dataclass(frozen=True)
+class DixonColesFeatures:
+    """Parameters of a fitted Dixon-Coles model, together with the diagnostics of the fit
+
+    The parameters are looked up by name, i.e. "attack_<team>", "defence_<team>",
+    "score_correction" and "home_advantage".
+    """
+    params: Dict[str, float]
+
+    converged: bool
+    message: str
+    iterations: int
+    evaluations: int
+    log_likelyhood: float
+    gradient_norm: float
+
+    def __getitem__(self, name: str) -> float:
+        return self.params[name]
+
+    def start_params(self, teams: List[str]) -> np.ndarray:
+        """Get the parameters of the given teams, to start another fit from
+
+        Teams without parameters start out with no attack and the average defence. The
+        attack is shifted to sum to zero, i.e. the parametrisation of the fit.
+
+        :param teams: the teams of the fit
+
+        """
+        defences = [value for name, value in self.params.items() if name.startswith("defence_")]
+        attack = np.array([self.params.get(f"attack_{team}", 0.) for team in teams])
+        defence = np.array([self.params.get(f"defence_{team}", np.mean(defences)) for team in teams])
+        shift = attack.mean()
+        score_correction = np.clip(self.params["score_correction"], *score_correction_bounds)
+        return np.concatenate([attack - shift, defence + shift, [score_correction, self.params["home_advantage"]]])
+
+
 class DixonColesModel(Model, verbose_name="dixon-coles"):
     @staticmethod
-    def calculate_model(selector: RangeSelector, session: Session) -> Dict[str, float]:
-        team_query = selector.build_team_query().with_session(session)
-        num_of_teams = team_query.count()
-        teams = [team.name for team in team_query]
-
-        (max_date,) = session.query(func.max(Match.date)).filter(selector.build_filters()).first()
-        dfs = [
-            {
-                "host": teams.index(match.host.name),
-                "guest": teams.index(match.guest.name),
-                "host_goals": match.host_points,
-                "guest_goals": match.guest_points,
-                "time_diff": np.exp((max_date - match.date).days * 0.001),
-            }
-            for match in selector.build_match_query().with_session(session)
-        ]
-        if len(dfs) == 0:
-            raise RuntimeError("Couldn't rebuild model, no matches for given selector...")
-        matches = pd.DataFrame(dfs)
-
-        def estimate_params(params):
-            attack = params[:num_of_teams]
-            defence = params[num_of_teams:-2]
-            score_correction, home_advantage = params[-2:]
-            return -1 * np.sum(
-                matches["time_diff"] *  # noqa: W504
-                log_likelyhood(
-                    matches["host_goals"], matches["guest_goals"],
-                    np.exp(attack[matches["host"]] + defence[matches["guest"]] + home_advantage),
-                    np.exp(attack[matches["guest"]] + defence[matches["guest"]]),
-                    score_correction
-                )
-            )
+    def calculate_model(frame: MatchFrame, warm_start: Optional[DixonColesFeatures] = None) -> Tuple[DixonColesFeatures, List[str]]:
+        teams = frame.teams
+        num_of_teams = len(teams)
+
+        # matches decay in weight with their age, matches with the same teams and result are
+        # collapsed into one, whose weight is the sum of their weights
+        days = (frame.date.max() - frame.date).astype("timedelta64[D]").astype(np.int64)
+        (host, guest, host_goals, guest_goals), weights = collapse_rows(
+            [frame.host, frame.guest, frame.host_goals, frame.guest_goals], np.exp(-time_decay * days)
+        )
+        likelyhood = DixonColesLikelihood(host, guest, host_goals, guest_goals, weights, num_of_teams)
 
+        # the attack of the last team is minus the sum of the others, which makes the parameters identifiable
+        # without any constraint, thus the fit can use a quasi-Newton method with the analytic gradient
+        if warm_start is None:
+            start_params = np.array([0.] * num_of_teams + [-0.08] * num_of_teams + [0.03, 0.06])
+        else:
+            start_params = warm_start.start_params(teams)
         min_result = minimize(
-            estimate_params,
-            np.array(
-                [.01] * num_of_teams +  # noqa: W504
-                [-0.08] * num_of_teams +  # noqa: W504
-                [0.03, 0.06]
-            ),
+            likelyhood.reduced,
+            np.delete(start_params, num_of_teams - 1),
+            jac=True,
+            method="L-BFGS-B",
+            bounds=[(None, None)] * (2 * num_of_teams - 1) + [score_correction_bounds, (None, None)],
             options={
-                # 'disp': True,
-                'maxiter': 100,
+                "maxiter": 500,
             },
-            constraints=[{
-                'type': 'eq',
-                'fun': lambda x: sum(x[:18]) - 18
-            }]
         )
+        if not min_result.success:
+            warnings.warn(f"Dixon-Coles fit didn't converge: {min_result.message}", RuntimeWarning)
 
-        features = dict(zip(
-            ["attack_" + team for team in teams] +
-            ["defence_" + team for team in teams] +
-            ['score_correction', 'home_advantage'],
-            min_result.x
-        ))
+        params = likelyhood.expand(min_result.x)
+        features = DixonColesFeatures(
+            params=dict(zip(
+                ["attack_" + team for team in teams] +  # noqa: W504
+                ["defence_" + team for team in teams] +  # noqa: W504
+                ["score_correction", "home_advantage"],
+                params.tolist()
+            )),
+            converged=bool(min_result.success),
+            message=str(min_result.message),
+            iterations=int(min_result.nit),
+            evaluations=int(min_result.nfev),
+            log_likelyhood=-float(min_result.fun),
+            gradient_norm=float(np.linalg.norm(min_result.jac, np.inf)),
+        )
 
         return features, teams
 
@@ -127,12 +159,108 @@ def apply_score_correction(host_goals, guest_goals, host_bias, guest_bias, score
         return 1.0
 
 
-apply_score_correction_vec = np.vectorize(apply_score_correction)
+class DixonColesLikelihood:
+    """Weighted negative log likelihood of the Dixon-Coles model as a function of its parameters
+
+    The parameters are the attack and defence of every team, followed by the
+    score correction and the home advantage. Everything which doesn't depend on
+    the parameters, i.e. the log factorials of the goals and the matches with low
+    scores, is computed once, thus every evaluation is a handful of array operations.
+
+    :param host: team codes of the hosts
+    :param guest: team codes of the guests
+    :param host_goals: goals of the hosts
+    :param guest_goals: goals of the guests
+    :param weights: weights of the matches
+    :param num_of_teams: number of teams, i.e. the size of the attack and defence parameters
+
+    """
+    def __init__(self, host: np.ndarray, guest: np.ndarray, host_goals: np.ndarray, guest_goals: np.ndarray,
+                 weights: np.ndarray, num_of_teams: int) -> None:
+        self.host = np.asarray(host, dtype=np.intp)
+        self.guest = np.asarray(guest, dtype=np.intp)
+        self.host_goals = np.asarray(host_goals, dtype=np.float64)
+        self.guest_goals = np.asarray(guest_goals, dtype=np.float64)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.num_of_teams = num_of_teams
+
+        # the score correction only applies to these results, see `apply_score_correction`
+        self.low_scores = {
+            score: np.flatnonzero((self.host_goals == score[0]) & (self.guest_goals == score[1]))
+            for score in ((0, 0), (0, 1), (1, 0), (1, 1))
+        }
+        self.log_factorials = np.dot(self.weights, gammaln(self.host_goals + 1) + gammaln(self.guest_goals + 1))
+
+    def rates(self, params: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the logs of the expected goals of the hosts and guests of all matches"""
+        attack = params[:self.num_of_teams]
+        defence = params[self.num_of_teams:2 * self.num_of_teams]
+        home_advantage = params[-1]
+        return attack[self.host] + defence[self.guest] + home_advantage, attack[self.guest] + defence[self.host]
+
+    def log_likelyhood(self, params: np.ndarray) -> float:
+        return self.log_likelyhood_and_gradient(params, gradient=False)[0]
+
+    def log_likelyhood_and_gradient(self, params: np.ndarray, gradient: bool = True) -> Tuple[float, Optional[np.ndarray]]:
+        """Get the log likelihood and its gradient with respect to the parameters
+
+        :param params: attack, defence, score correction and home advantage
+        :param gradient: whether to compute the gradient (default value = True)
+
+        """
+        log_host_bias, log_guest_bias = self.rates(params)
+        host_bias, guest_bias = np.exp(log_host_bias), np.exp(log_guest_bias)
+        score_correction = params[-2]
+        weights = self.weights
+
+        # derivatives of the log likelihood of every match by the logs of the expected goals
+        host_slope = weights * (self.host_goals - host_bias)
+        guest_slope = weights * (self.guest_goals - guest_bias)
+        result = np.dot(weights, self.host_goals * log_host_bias + self.guest_goals * log_guest_bias) - host_bias.dot(weights) - guest_bias.dot(weights) - self.log_factorials
+
+        low_scores = self.low_scores
+        score_correction_slope = 0.
+        with np.errstate(invalid="ignore", divide="ignore"):
+            matches = low_scores[0, 0]
+            product = host_bias[matches] * guest_bias[matches]
+            correction = 1 - product * score_correction
+            result += np.dot(weights[matches], np.log(correction))
+            if gradient:
+                slope = weights[matches] * product * score_correction / correction
+                host_slope[matches] -= slope
+                guest_slope[matches] -= slope
+                score_correction_slope -= np.dot(weights[matches], product / correction)
+
+            for matches, bias, slopes in ((low_scores[0, 1], host_bias, host_slope), (low_scores[1, 0], guest_bias, guest_slope)):
+                correction = 1 + bias[matches] * score_correction
+                result += np.dot(weights[matches], np.log(correction))
+                if gradient:
+                    slopes[matches] += weights[matches] * bias[matches] * score_correction / correction
+                    score_correction_slope += np.dot(weights[matches], bias[matches] / correction)
+
+            weight = weights[low_scores[1, 1]].sum()
+            result += weight * np.log(1 - score_correction)
+            score_correction_slope -= weight / (1 - score_correction)
+
+        if not gradient:
+            return result, None
+        num_of_teams = self.num_of_teams
+        attack_slope = np.bincount(self.host, host_slope, num_of_teams) + np.bincount(self.guest, guest_slope, num_of_teams)
+        defence_slope = np.bincount(self.guest, host_slope, num_of_teams) + np.bincount(self.host, guest_slope, num_of_teams)
+        return result, np.concatenate([attack_slope, defence_slope, [score_correction_slope, host_slope.sum()]])
+
+    def expand(self, reduced: np.ndarray) -> np.ndarray:
+        """Expand reduced parameters, without the attack of the last team, to all parameters"""
+        return np.concatenate([reduced[:self.num_of_teams - 1], [-reduced[:self.num_of_teams - 1].sum()], reduced[self.num_of_teams - 1:]])
 
+    def reduced(self, reduced: np.ndarray) -> Tuple[float, np.ndarray]:
+        """Get the negative log likelihood and its gradient as a function of the reduced parameters, see `expand`"""
+        result, gradient = self.log_likelyhood_and_gradient(self.expand(reduced))
+        if not np.isfinite(result):
+            return np.inf, np.zeros_like(reduced)
+        last = self.num_of_teams - 1
+        gradient = np.concatenate([gradient[:last] - gradient[last], gradient[last + 1:]])
+        return -result, -gradient
 
-def log_likelyhood(host_goals, guest_goals, host_bias, guest_bias, score_correction):
-    return (
-        np.log(apply_score_correction_vec(host_goals, guest_goals, host_bias, guest_bias, score_correction)) +  # noqa: W504
-        np.log(poisson.pmf(host_goals, host_bias)) +  # noqa: W504
-        np.log(poisson.pmf(guest_goals, guest_bias))
-    )
+    def __call__(self, params: np.ndarray) -> float:
+        return -self.log_likelyhood(params)
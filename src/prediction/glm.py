@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import scipy.linalg
+import scipy.sparse as sp
+from scipy.special import xlogy
+
+
+__all__ = (
+    "GLMFit",
+    "fit_poisson_glm",
+)
+
+
+@dataclass(frozen=True)
+class GLMFit:
+    params: np.ndarray
+
+    converged: bool
+    iterations: int
+    deviance: float
+
+
+def poisson_deviance(y: np.ndarray, mu: np.ndarray, weights: np.ndarray) -> float:
+    return 2 * np.dot(weights, xlogy(y, y / mu) - (y - mu))
+
+
+def fit_poisson_glm(
+    design: sp.spmatrix, y: np.ndarray, weights: Optional[np.ndarray] = None, start_params: Optional[np.ndarray] = None,
+    tol: float = 1e-8, maxiter: int = 100,
+) -> GLMFit:
+    """Fit a Poisson GLM with log link via iteratively reweighted least squares
+
+    Every iteration is a weighted least squares fit, whose normal equations are
+    built from the sparse design matrix, thus the costs grow linearly with the
+    number of rows and only the small normal matrix is dense. The iteration
+    follows statsmodels' GLM.fit, i.e. the same start and convergence criterion,
+    thus the coefficients are the same.
+
+    :param design: design matrix, one row per observation
+    :param y: observed counts
+    :param weights: frequency weights of the observations (default value = None, i.e. all ones)
+    :param start_params: coefficients to start from (default value = None, i.e. start from the mean of y)
+    :param tol: convergence tolerance of the change of the deviance (default value = 1e-8)
+    :param maxiter: maximum number of iterations (default value = 100)
+
+    """
+    design = sp.csr_matrix(design, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    weights = np.ones_like(y) if weights is None else np.asarray(weights, dtype=np.float64)
+
+    if start_params is None:
+        mu = (y + np.average(y, weights=weights)) / 2
+        eta = np.log(mu)
+    else:
+        eta = design @ start_params
+        mu = np.exp(eta)
+    params = start_params
+    deviance = poisson_deviance(y, mu, weights)
+
+    converged = False
+    iterations = 0
+    while iterations < maxiter and not converged:
+        # working response and weights of the log link, which is canonical for the Poisson family
+        working_weights = weights * mu
+        weighted = design.T.multiply(working_weights).tocsr()
+        normal_matrix = (weighted @ design).toarray()
+        params = scipy.linalg.solve(normal_matrix, weighted @ (eta + (y - mu) / mu), assume_a="pos")
+
+        eta = design @ params
+        mu = np.exp(eta)
+        previous_deviance, deviance = deviance, poisson_deviance(y, mu, weights)
+        iterations += 1
+        converged = abs(deviance - previous_deviance) < tol
+
+    return GLMFit(params=params, converged=converged, iterations=iterations, deviance=deviance)
@@ -1,22 +1,22 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-import pickle
+from typing import Optional, Tuple, List, Dict, Any
+import warnings
 
-import pandas as pd
 import numpy as np
+import scipy.sparse as sp
 from scipy.stats import poisson
-import statsmodels.api as sm
-import statsmodels.formula.api as smf
-from sqlalchemy.orm import Session
 
-from ..db import RangeSelector
-from .base import Model, PredictionResult
+from ..db import MatchFrame
+from .base import Model, PredictionResult, collapse_rows
+from .glm import fit_poisson_glm
 
 
 __all__ = (
     "PoissonModel",
-    "PoissonResult"
+    "PoissonResult",
+    "PoissonFeatures",
 )
 
 
@@ -55,6 +55,50 @@ class PoissonResult(PredictionResult):
         ])
 
 
+@dataclass(frozen=True)
+class PoissonFeatures:
+    """Coefficients of a fitted Poisson regression, together with the diagnostics of the fit
+
+    The coefficients are named like the ones of the formula "goals ~ home + team + opponent",
+    e.g. "Intercept", "home", "team[T.<team>]" and "opponent[T.<team>]".
+    """
+    params: Dict[str, float]
+    reference: str
+
+    converged: bool
+    iterations: int
+    deviance: float
+
+    @classmethod
+    def from_glm_results(cls, results: Any, teams: List[str]) -> PoissonFeatures:
+        """Convert the statsmodels GLM results, which were the features of models pickled by earlier versions
+
+        :param results: results of the fit of the formula "goals ~ home + team + opponent"
+        :param teams: teams of the model
+
+        """
+        try:
+            params = {str(name): float(value) for name, value in results.params.items()}
+            return cls(
+                params=params,
+                reference=sorted(teams)[0],
+                converged=bool(getattr(results, "converged", True)),
+                iterations=int(getattr(results, "fit_history", {}).get("iteration", 0)),
+                deviance=float(results.deviance),
+            )
+        except (AttributeError, TypeError, ValueError, IndexError) as e:
+            raise ValueError("Model file too old, please rebuild the model.") from e
+
+    def expected_goals(self, team: str, opponent: str, home: bool) -> float:
+        """Get the expected goals of a team, scored against an opponent"""
+        params = self.params
+        return np.exp(
+            params["Intercept"] + params["home"] * home +  # noqa: W504
+            (params[f"team[T.{team}]"] if team != self.reference else 0.) +  # noqa: W504
+            (params[f"opponent[T.{opponent}]"] if opponent != self.reference else 0.)
+        )
+
+
 class PoissonModel(Model, verbose_name="poisson"):
     """Poisson Regression
 
@@ -68,23 +112,16 @@ class PoissonModel(Model, verbose_name="poisson"):
        per season, the predictions will be unreliable.
 
     """
-    @staticmethod
-    def calculate_model(selector: RangeSelector, session: Session):
-        dfs = [
-            {
-                "host": match.host.name,
-                "guest": match.guest.name,
-                "host_goals": match.host_points,
-                "guest_goals": match.guest_points,
-            }
-            for match in selector.build_match_query().with_session(session)
-        ]
-        if len(dfs) == 0:
-            raise RuntimeError("Couldn't rebuild model, no matches for given selector...")
-        goal_data = pd.DataFrame(dfs)
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        # models pickled by earlier versions have the statsmodels results as features
+        if not isinstance(self.features, PoissonFeatures):
+            self.features = PoissonFeatures.from_glm_results(self.features, self.teams)
 
-        # Here the model for the goals is created,
-        # the resulting dataframe follows the form:
+    @staticmethod
+    def calculate_model(frame: MatchFrame, warm_start: Optional[PoissonFeatures] = None) -> Tuple[PoissonFeatures, List[str]]:
+        # Here the model for the goals is created, every match is
+        # represented by two rows of the following form:
         # <team> | <opponent> | <goals> | <home>
         # --------------------------------------
         # team:     represents the team to which the goal count belongs
@@ -93,46 +130,56 @@ class PoissonModel(Model, verbose_name="poisson"):
         # home:     1|0 where 1 represents that the team
         #           hosted the match and 0 the opposite
         # --------------------------------------
-        goal_model = pd.concat([
-            goal_data[["host", "guest", "host_goals"]].assign(home=1).rename(
-                columns={
-                    "host": "team",
-                    "guest": "opponent",
-                    "host_goals": "goals"
-                }
-            ),
-            goal_data[["host", "guest", "guest_goals"]].assign(home=0).rename(
-                columns={
-                    "guest": "team",
-                    "host": "opponent",
-                    "guest_goals": "goals"
-                }
-            ),
-        ], sort=False)
-
-        features = smf.glm(
-            formula="goals ~ home + team + opponent",
-            data=goal_model,
-            family=sm.families.Poisson()
-        ).fit()
+        # team and opponent are treatment coded, with the alphabetically first team
+        # as reference, i.e. goals ~ home + team + opponent as a formula
+        num_of_matches, num_of_teams = len(frame), len(frame.teams)
+        levels = sorted(frame.teams)
+        level = np.empty(num_of_teams, dtype=np.int64)
+        level[np.argsort(np.array(frame.teams, dtype=object), kind="stable")] = np.arange(num_of_teams)
+
+        # identical rows are collapsed into one, weighted by their count
+        (team, opponent, home, goals), counts = collapse_rows([
+            level[np.concatenate([frame.host, frame.guest])],
+            level[np.concatenate([frame.guest, frame.host])],
+            np.repeat([1, 0], num_of_matches),
+            np.concatenate([frame.host_goals, frame.guest_goals]),
+        ])
 
-        return features, list(goal_data["host"].unique())
+        num_of_rows = len(counts)
+        rows = np.arange(num_of_rows)
+        is_home, has_team, has_opponent = home == 1, team > 0, opponent > 0
+        design = sp.csr_matrix((
+            np.ones(num_of_rows + is_home.sum() + has_team.sum() + has_opponent.sum()),
+            (
+                np.concatenate([rows, rows[is_home], rows[has_team], rows[has_opponent]]),
+                np.concatenate([
+                    np.zeros(num_of_rows, dtype=np.int64),
+                    np.ones(is_home.sum(), dtype=np.int64),
+                    1 + team[has_team],
+                    num_of_teams + opponent[has_opponent],
+                ]),
+            ),
+        ), shape=(num_of_rows, 2 * num_of_teams))
+
+        names = ["Intercept", "home"] + [f"team[T.{name}]" for name in levels[1:]] + [f"opponent[T.{name}]" for name in levels[1:]]
+        # coefficients of teams new to the selection start out as average teams
+        start_params = None if warm_start is None else np.array([warm_start.params.get(name, 0.) for name in names])
+        fit = fit_poisson_glm(design, goals, counts, start_params=start_params)
+        if not fit.converged:
+            warnings.warn(f"Poisson regression didn't converge within {fit.iterations} iterations", RuntimeWarning)
+
+        features = PoissonFeatures(
+            params=dict(zip(names, fit.params.tolist())),
+            reference=levels[0],
+            converged=fit.converged,
+            iterations=fit.iterations,
+            deviance=fit.deviance,
+        )
+        return features, list(frame.teams)
 
     def make_prediction(self, host_name: str, guest_name: str, max_goals: int = 10) -> PoissonResult:
-        host_goals_avg = self.features.predict(
-            pd.DataFrame(data={
-                "team": host_name,
-                "opponent": guest_name,
-                "home": 1
-            }, index=[1])
-        ).values[0]
-        guest_goals_avg = self.features.predict(
-            pd.DataFrame(data={
-                "team": guest_name,
-                "opponent": host_name,
-                "home": 0
-            }, index=[1])
-        ).values[0]
+        host_goals_avg = self.features.expected_goals(host_name, guest_name, home=True)
+        guest_goals_avg = self.features.expected_goals(guest_name, host_name, home=False)
 
         prediction = [
             [
@@ -1,8 +1,27 @@
+import gzip
+import json
+import os
 import unittest
+import zipfile
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from tempfile import TemporaryDirectory
+from threading import Thread
+
+from sqlalchemy import event
 
 from ..db.core import _DB
+from ..db.cache import current_generation
 from ..db.models import *  # noqa: 401
-from ..acquisition import download_matches, clean_download_list
+from ..acquisition import download_matches, clean_download_list, checkpointed_ingest, pending_years, sync_matches
+from ..acquisition.core import Pipeline
+from ..acquisition.pipeline import _download_matches
+from ..acquisition.fetcher import AsyncFetcher, FetchError
+from ..acquisition.cache import ResponseCache
+from ..acquisition.archive import ResponseArchive
+from ..acquisition.dumps import read_dumps
+from ..acquisition.ingest import season_rows, bulk_ingest, convert_seasons
+from ..acquisition.transformations import Get, GetOrCreate, Custom, If, Constant, Filter
 
 
 class _DummyYear(int):
@@ -92,3 +111,475 @@ class TestAcquisition(unittest.TestCase):
     def test_aqcuisition_with_collision(self):
         """>>> Test the acquisition for collisions."""
         self.download([2015, 2016, 2017])
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        self.DB = _DB("sqlite:///:memory:")
+        self.DB.drop_tables()
+        self.DB.create_tables()
+        self.pipeline = Pipeline({
+            Team: {
+                "id": Get("TeamId"),
+                "name": Get("TeamName"),
+            },
+        })
+
+    def count_queries(self, func):
+        """Count the select statements issued by a function
+
+        :param func: function to call with a fresh session
+
+        """
+        queries = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            if statement.startswith("SELECT"):
+                queries.append(statement)
+
+        event.listen(self.DB._engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            with self.DB.get_session() as session:
+                func(session)
+        finally:
+            event.remove(self.DB._engine, "before_cursor_execute", before_cursor_execute)
+        return len(queries)
+
+    def test_get_or_create_identity_map(self):
+        """>>> Test that GetOrCreate looks up each instance only once per run."""
+        get_or_create = GetOrCreate(Team, match_targets=["id"])
+        rows = [{"TeamId": i % 3, "TeamName": f"Team {i % 3}"} for i in range(30)]
+
+        def run(session):
+            self.pipeline.reset_identity_map()
+            teams = [get_or_create(self.pipeline, row, session) for row in rows]
+            assert len(set(map(id, teams))) == 3
+
+        assert self.count_queries(run) == 1
+        assert self.count_queries(run) == 1
+        with self.DB.get_session() as session:
+            assert session.query(Team).count() == 3
+
+    def test_create_multiple_batched(self):
+        """>>> Test that batched creation commits and expunges the created instances."""
+        rows = [{"TeamId": i, "TeamName": f"Team {i}"} for i in range(10)]
+        with self.DB.get_session() as session:
+            for team in self.pipeline.create_multiple(Team, rows, session, batch_size=4):
+                assert team in session
+            assert len(session.identity_map) == 0
+            assert session.query(Team).count() == 10
+
+    def test_compile(self):
+        """>>> Test that compiled transformation maps match the interpreted ones."""
+        calls = []
+
+        def count_calls(data):
+            calls.append(data)
+            return data
+
+        shared = Get("Results") | Custom(count_calls)
+        pipeline = Pipeline({
+            dict: {
+                "id": Get("Id"),
+                "first": shared | If(cond=lambda data: len(data) > 0, then=Get(0), else_=Constant(None)),
+                "last": shared | If(cond=lambda data: len(data) > 0, then=Get(-1)),
+                "even": shared | Filter(lambda item: item % 2 == 0),
+            },
+        })
+        rows = [{"Id": 1, "Results": [1, 2, 3, 4]}, {"Id": 2, "Results": []}]
+
+        interpreted = [pipeline.generate_kwargs(dict, row, None) for row in rows]
+        assert len(calls) == 6
+        compiled = [pipeline.create(dict, row, None) for row in rows]
+        assert len(calls) == 8
+        assert interpreted == compiled
+
+    def test_create_columns(self):
+        """>>> Test that column-wise evaluation matches the row-wise one."""
+        shared = Get("Results") | Filter(lambda item: item > 0)
+        pipeline = Pipeline({
+            dict: {
+                "id": Get("Id"),
+                "first": shared | If(cond=lambda data: len(data) > 0, then=Get(0), else_=Constant(None)),
+                "last": shared | If(cond=lambda data: len(data) > 0, then=Get(-1)),
+                "results": shared,
+                "name": Get("Name") | Custom(str.upper),
+            },
+        })
+        rows = [{"Id": 1, "Results": [1, -2, 3], "Name": "a"}, {"Id": 2, "Results": [], "Name": "b"}, {"Id": 3, "Results": [0], "Name": "c"}]
+
+        columns = pipeline.create_columns(dict, rows)
+        assert list(columns) == ["id", "first", "last", "results", "name"]
+        assert [dict(zip(columns, values)) for values in zip(*(column.tolist() for column in columns.values()))] == [
+            pipeline.generate_kwargs(dict, row, None) for row in rows
+        ]
+        assert all(len(column) == 0 for column in pipeline.create_columns(dict, []).values())
+
+    def test_profile(self):
+        """>>> Test that profiling records every model, field and transformation."""
+        rows = [{"TeamId": i, "TeamName": f"Team {i}"} for i in range(10)]
+        with self.DB.get_session() as session, self.pipeline.profile(self.DB.engine) as profiler:
+            list(self.pipeline.create_multiple(Team, rows, session, batch_size=4))
+        assert self.pipeline.profiler is None
+
+        assert profiler.stats[("Team",)].calls == 10
+        assert profiler.stats[("Team", "Team.name", "Get('TeamName')")].calls == 10
+        assert profiler.stats[("commit",)].calls == 3
+        assert profiler.stats[("commit",)].queries > 0
+        assert profiler.stats[("Team",)].queries == 0
+        assert "Get('TeamId')" in profiler.format_table()
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    """Serves fake match data, failing the first request of each path, and redirects /moved/<path> to /<path>."""
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.connections.add(self.client_address)
+        self.server.requests.append((self.path, self.headers.get("If-None-Match")))
+        if self.path.startswith(("/moved/", "/loop")):
+            self.send_response(301)
+            self.send_header("Location", self.path[len("/moved"):] if self.path.startswith("/moved/") else "/loop")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.headers.get("If-None-Match") == f'"{self.path}"':
+            self.send_response(304)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.path not in self.server.failed:
+            self.server.failed.add(self.path)
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        body = gzip.compress(json.dumps([{"Path": self.path}]).encode())
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Encoding", "gzip")
+        self.send_header("ETag", f'"{self.path}"')
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        ...
+
+
+class TestFetcher(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _StandInHandler)
+        self.server.connections = set()
+        self.server.requests = []
+        self.server.failed = set()
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/{{league}}/{{year}}"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_download(self):
+        """>>> Test downloading via the async fetcher from a local server."""
+        years = list(range(2000, 2010))
+        results = dict(_download_matches(years, "bl1", concurrency=2, url=self.url, cache=None))
+        assert sorted(results) == years
+        assert all(data == [{"Path": f"/bl1/{year}"}] for year, data in results.items())
+        assert len(self.server.connections) <= 2
+
+        with TemporaryDirectory() as directory:
+            archive = ResponseArchive(os.path.join(directory, "responses.archive"))
+            assert dict(_download_matches(years[:2], "bl1", url=self.url, cache=None, archive=archive)) == dict(archive.replay("bl1"))
+
+    def test_cache(self):
+        """>>> Test revalidation and ttl of cached responses."""
+        with TemporaryDirectory() as directory:
+            fetcher = AsyncFetcher(cache=ResponseCache(directory), backoff=0)
+            url = self.url.format(league="bl1", year=2000)
+
+            first = fetcher.get(url)
+            assert not first.cached
+            second = fetcher.get(url)
+            assert second.cached and second.status == 304
+            assert second.json() == first.json()
+            third = fetcher.get(url, ttl=60)
+            assert third.cached and third.json() == first.json()
+            assert self.server.requests == [
+                ("/bl1/2000", None),
+                ("/bl1/2000", None),
+                ("/bl1/2000", '"/bl1/2000"'),
+            ]
+
+    def test_redirect(self):
+        """>>> Test that redirects are followed and only the final response is cached."""
+        with TemporaryDirectory() as directory:
+            cache = ResponseCache(directory)
+            fetcher = AsyncFetcher(cache=cache, backoff=0)
+            base = f"http://127.0.0.1:{self.server.server_port}"
+
+            response = fetcher.get(f"{base}/moved/bl1/2000")
+            assert response.status == 200 and response.url == f"{base}/bl1/2000" and response.requested_url == f"{base}/moved/bl1/2000"
+            assert response.json() == [{"Path": "/bl1/2000"}]
+            assert cache.get(f"{base}/moved/bl1/2000") is not None
+
+            with self.assertRaises(FetchError) as context:
+                fetcher.get(f"{base}/loop")
+            assert context.exception.status == 301 and cache.get(f"{base}/loop") is None
+
+            moved = f"{base}/moved/{{league}}/{{year}}"
+            assert dict(_download_matches([2000, 2001], "bl1", url=moved, cache=None)) == {
+                2000: [{"Path": "/bl1/2000"}],
+                2001: [{"Path": "/bl1/2001"}],
+            }
+
+    def test_proxy(self):
+        """>>> Test that the proxy configured in the environment is used."""
+        proxy = f"http://127.0.0.1:{self.server.server_port}"
+        with mock.patch.dict(os.environ, {"HTTP_PROXY": proxy, "http_proxy": proxy, "NO_PROXY": "", "no_proxy": ""}):
+            response = AsyncFetcher(backoff=0).get("http://openligadb.invalid/bl1/2000")
+        assert response.json() == [{"Path": "http://openligadb.invalid/bl1/2000"}]
+
+
+class TestDumps(unittest.TestCase):
+    def test_read_dumps(self):
+        """>>> Test reading compressed and archived match dumps."""
+        data = [{"LeagueName": "1. Fußball-Bundesliga 2016/2017", "MatchDateTime": "2017-04-01T15:30:00"}]
+        with TemporaryDirectory() as directory:
+            with open(os.path.join(directory, "bl1_2015.json"), "w") as fp:
+                json.dump(data, fp)
+            with gzip.open(os.path.join(directory, "matches.json.gz"), "wt") as fp:
+                json.dump(data, fp)
+            with open(os.path.join(directory, "notes.txt"), "w") as fp:
+                fp.write("not a dump")
+            assert sorted(year for year, _ in read_dumps(directory, workers=2)) == [2015, 2016]
+
+            archive_path = os.path.join(directory, "dumps.zip")
+            with zipfile.ZipFile(archive_path, "w") as archive:
+                archive.writestr("2017.json", json.dumps(data))
+            assert list(read_dumps(archive_path, workers=1)) == [(2017, data)]
+
+            for year in range(2000, 2010):
+                with open(os.path.join(directory, f"{year}.json"), "w") as fp:
+                    json.dump(data, fp)
+            assert len(list(read_dumps(directory, workers=1))) == 12
+
+
+class TestArchive(unittest.TestCase):
+    def test_replay(self):
+        """>>> Test appending responses to an archive and replaying the latest ones."""
+        with TemporaryDirectory() as directory:
+            archive = ResponseArchive(os.path.join(directory, "responses.archive"))
+            assert list(archive.replay()) == []
+            assert archive.append("bl1", 2016, b'[{"MatchID": 1}]', fetched_at=1.) is not None
+            assert archive.append("bl1", 2016, b'[{"MatchID": 1}]', fetched_at=2.) is None
+            assert archive.append("bl1", 2017, b'[{"MatchID": 3}]', fetched_at=3.) is not None
+            assert archive.append("bl1", 2016, b'[{"MatchID": 2}]', fetched_at=4.) is not None
+            assert archive.append("bl2", 2016, b'[{"MatchID": 4}]', fetched_at=5.) is not None
+
+            expected = [(2017, [{"MatchID": 3}]), (2016, [{"MatchID": 2}])]
+            assert list(archive.replay()) == expected
+            assert list(archive.replay("bl2")) == [(2016, [{"MatchID": 4}])]
+            assert list(ResponseArchive(archive.path).replay(years=[2016])) == [(2016, [{"MatchID": 2}])]
+
+            os.remove(archive.index_path)
+            rebuilt = ResponseArchive(archive.path)
+            assert rebuilt.frames() == archive.frames()
+            assert list(rebuilt.replay()) == expected
+
+
+class TestBulkIngest(unittest.TestCase):
+    @staticmethod
+    def raw_match(match_id, group_id, host_id, guest_id):
+        return {
+            "MatchID": match_id,
+            "MatchDateTime": "2016-08-26T20:30:00",
+            "MatchIsFinished": True,
+            "Group": {"GroupID": group_id, "GroupOrderID": group_id % 100},
+            "Team1": {"TeamId": host_id, "TeamName": f"Team {host_id}", "ShortName": ""},
+            "Team2": {"TeamId": guest_id, "TeamName": f"Team {guest_id}", "ShortName": f"T{guest_id}"},
+            "MatchResults": [
+                {"ResultName": "Halbzeit", "PointsTeam1": 0, "PointsTeam2": 0},
+                {"ResultName": "Endergebnis", "PointsTeam1": 2, "PointsTeam2": 1},
+            ],
+        }
+
+    def test_convert_seasons_streams(self):
+        """>>> Test that converted seasons are yielded while later seasons are still being read."""
+        consumed = []
+
+        def seasons():
+            for year in range(2000, 2010):
+                consumed.append(year)
+                yield year, [self.raw_match(year, year * 100 + 1, 1, 2)]
+
+        rows = convert_seasons(seasons(), workers=1)
+        first = next(rows)
+        assert first.year in consumed and len(consumed) <= 3
+        assert sorted([first.year] + [season.year for season in rows]) == list(range(2000, 2010))
+        assert len(consumed) == 10
+
+    def test_bulk_ingest(self):
+        """>>> Test converting seasons into rows and inserting them in bulk."""
+        seasons = [
+            season_rows(2016, [self.raw_match(1, 1601, 1, 2), self.raw_match(2, 1602, 2, 1)]),
+            season_rows(2017, [self.raw_match(3, 1701, 1, 3)]),
+        ]
+        assert seasons[0].matches[0].host_points == 2 and seasons[0].matches[0].guest_points == 1
+        assert seasons[0].participations == [(1, 1, True), (2, 1, False), (2, 2, True), (1, 2, False)]
+
+        with TemporaryDirectory() as directory:
+            DB = _DB(f"sqlite:///{os.path.join(directory, 'db.sqlite3')}")
+            DB.create_tables()
+            assert [(rows.year, skipped) for rows, skipped in bulk_ingest(DB.engine, seasons)] == [(2016, False), (2017, False)]
+            assert [(rows.year, skipped) for rows, skipped in bulk_ingest(DB.engine, seasons[:1])] == [(2016, True)]
+
+            with DB.get_session() as session:
+                assert session.query(Match).count() == 3
+                assert [team.name for team in session.query(Team).order_by(Team.id)] == ["Team 1", "T2", "T3"]
+                match = session.query(Match).get(3)
+                assert (match.host.id, match.guest.id, match.group.order_id, match.group.season.year) == (1, 3, 1, 2017)
+                assert match.group.matchday_key == 201701
+                assert sorted(season.year for season in match.host.seasons) == [2016, 2017]
+            DB.engine.dispose()
+
+
+class TestBackfill(unittest.TestCase):
+    def setUp(self):
+        self.DB = _DB("sqlite:///:memory:")
+        self.DB.drop_tables()
+        self.DB.create_tables()
+
+    def ingest(self, seasons):
+        with self.DB.get_session() as session:
+            for _ in checkpointed_ingest(session, seasons):
+                ...
+
+    def test_resume(self):
+        """>>> Test that an interrupted ingest keeps completed groups and resumes from them."""
+        raw_match = TestBulkIngest.raw_match
+        season_2016 = [raw_match(1, 1601, 1, 2), raw_match(2, 1601, 3, 4), raw_match(3, 1602, 2, 1), raw_match(4, 1602, 4, 3)]
+        season_2017 = [raw_match(5, 1701, 1, 3)]
+        broken_2016 = season_2016[:3] + [{"MatchID": 4, "Group": season_2016[3]["Group"]}]
+
+        def flaky():
+            yield 2016, broken_2016
+            yield 2017, season_2017
+
+        with self.assertRaises(KeyError):
+            self.ingest(flaky())
+        with self.DB.get_session() as session:
+            assert sorted(match.id for match in session.query(Match)) == [1, 2]
+            assert pending_years(session, [2015, 2016, 2017]) == [2015, 2016, 2017]
+
+        self.ingest([(2016, season_2016), (2017, season_2017)])
+        with self.DB.get_session() as session:
+            assert sorted(match.id for match in session.query(Match)) == [1, 2, 3, 4, 5]
+            assert [season.year for season in session.query(Season).order_by(Season.year)] == [2016, 2017]
+            assert session.query(Group).filter(Group.season.has(year=2016)).count() == 2
+            assert sorted(key for (key,) in session.query(Group.matchday_key)) == [201601, 201602, 201701]
+            assert (session.query(Match).get(3).host.id, session.query(Match).get(3).guest.id) == (2, 1)
+            assert pending_years(session, [2015, 2016, 2017]) == [2015]
+
+            session.add(Season(year=2015))
+        with self.DB.get_session() as session:
+            assert pending_years(session, [2015, 2016, 2017]) == []
+
+
+class _MatchDataHandler(BaseHTTPRequestHandler):
+    """Serves the raw match data of `server.responses` by path."""
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        if self.path not in self.server.responses:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        body = json.dumps(self.server.responses[self.path]).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        ...
+
+
+class TestSync(unittest.TestCase):
+    def setUp(self):
+        self.DB = _DB("sqlite:///:memory:")
+        self.DB.drop_tables()
+        self.DB.create_tables()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _MatchDataHandler)
+        self.server.requests = []
+        self.server.responses = {}
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{self.server.server_port}"
+        self.urls = {"url": f"{base}/{{league}}/{{year}}", "group_url": f"{base}/{{league}}/{{year}}/{{group}}"}
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @staticmethod
+    def raw_match(match_id, group_id, host_id, guest_id, result=None):
+        match = TestBulkIngest.raw_match(match_id, group_id, host_id, guest_id)
+        if result is None:
+            match.update(MatchIsFinished=False, MatchResults=[])
+        else:
+            match["MatchResults"][1].update(PointsTeam1=result[0], PointsTeam2=result[1])
+        return match
+
+    def sync(self, years=()):
+        with self.DB.get_session() as session:
+            generation = current_generation(session)
+            synced = sorted((match.id, created) for match, created in sync_matches(session, years, use_cache=False, **self.urls))
+        with self.DB.get_session() as session:
+            return synced, current_generation(session) > generation
+
+    def test_sync(self):
+        """>>> Test that results are updated and new matches created from the stale groups only."""
+        with self.DB.get_session() as session:
+            for _ in checkpointed_ingest(session, [(2016, [
+                self.raw_match(1, 1601, 1, 2, (2, 1)), self.raw_match(2, 1601, 3, 4, (0, 0)),
+                self.raw_match(3, 1602, 2, 1), self.raw_match(4, 1602, 4, 3),
+            ])]):
+                ...
+        self.server.responses["/bl1/2016/2"] = [
+            self.raw_match(3, 1602, 2, 1, (1, 1)), self.raw_match(4, 1602, 4, 3), self.raw_match(5, 1602, 5, 6),
+        ]
+
+        assert self.sync() == ([(3, False), (5, True)], True)
+        assert self.server.requests == ["/bl1/2016/2"]
+        with self.DB.get_session() as session:
+            match = session.query(Match).get(3)
+            assert match.is_finished and (match.host_points, match.guest_points) == (1, 1)
+            match = session.query(Match).get(5)
+            assert not match.is_finished and match.group.season.year == 2016
+            assert [season.year for season in match.host.seasons] == [2016]
+
+    def test_sync_up_to_date(self):
+        """>>> Test that a sync without stale groups sends no requests and changes nothing."""
+        with self.DB.get_session() as session:
+            for _ in checkpointed_ingest(session, [(2016, [self.raw_match(1, 1601, 1, 2, (2, 1))])]):
+                ...
+
+        assert self.sync() == ([], False)
+        assert self.server.requests == []
+
+    def test_sync_season(self):
+        """>>> Test that a season with many stale groups is fetched with a single request."""
+        season = [self.raw_match(1, 1601, 1, 2, (2, 1))] + [self.raw_match(group, 1600 + group, 1, 2) for group in range(2, 7)]
+        with self.DB.get_session() as session:
+            for _ in checkpointed_ingest(session, [(2016, season)]):
+                ...
+        season[1] = self.raw_match(2, 1602, 1, 2, (0, 3))
+        self.server.responses["/bl1/2016"] = season
+
+        assert self.sync() == ([(2, False)], True)
+        assert self.server.requests == ["/bl1/2016"]
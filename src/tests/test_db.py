@@ -1,17 +1,262 @@
+import os
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from tempfile import TemporaryDirectory
+from threading import Event, current_thread
+
+import numpy as np
 
 from sqlalchemy.orm import Session
 
-from ..db.core import _DB
+from sqlalchemy import event
+
+from ..db.core import _DB, engine_profiles
+from ..db.selectors import RangeSelector, RangePoint, season_years
+from ..db.frames import load_match_frame, extend_match_frame
+from ..db.migrations import migrations
+from ..db.cache import query_cache, current_generation
 from ..db.models import *  # noqa: F401
 
 
 class TestDB(unittest.TestCase):
     def setUp(self):
         self.DB = _DB("sqlite:///:memory:")
+        self.DB.drop_tables()
         self.DB.create_tables()
 
     def test_get_session(self):
         """>>> Test the session functionality of our DB-wrapper-class."""
         with self.DB.get_session() as session:
             assert isinstance(session, Session)
+
+    def test_migrate(self):
+        """>>> Test that existing DBs are migrated and fresh ones only recorded as migrated."""
+        versions = [migration.version for migration in migrations]
+        with self.DB.engine.connect() as connection:
+            assert [version for (version,) in connection.execute("SELECT version FROM schema_migrations")] == versions
+            plan = " ".join(row[-1] for row in connection.execute(
+                "EXPLAIN QUERY PLAN SELECT * FROM matches WHERE group_id = 1"
+            ))
+            assert "ix_matches_group_id" in plan
+
+            # turn the DB into one predating all migrations
+            connection.execute("DELETE FROM schema_migrations")
+            for (name,) in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'ix_%'").fetchall():
+                connection.execute(f"DROP INDEX {name}")
+            connection.execute("INSERT INTO teams (id, name) VALUES (1, 'Host'), (2, 'Guest')")
+            connection.execute("INSERT INTO seasons (id, year) VALUES (1, 2016)")
+            connection.execute("INSERT INTO groups (id, order_id, season_id) VALUES (1, 3, 1)")
+            connection.execute("INSERT INTO matches (id) VALUES (1)")
+            connection.execute("INSERT INTO match_participations (team_id, match_id, hosted) VALUES (1, 1, 1), (2, 1, 0)")
+
+        assert [migration.version for migration in self.DB.create_tables()] == versions
+        assert self.DB.create_tables() == []
+        with self.DB.engine.connect() as connection:
+            assert connection.execute("SELECT count(*) FROM sqlite_master WHERE name = 'ix_matches_group_id'").scalar() == 1
+        with self.DB.get_session() as session:
+            match = session.query(Match).get(1)
+            assert (match.host.name, match.guest.name) == ("Host", "Guest")
+            assert session.query(Group).get(1).matchday_key == 201603
+
+    def test_engine_profiles(self):
+        """>>> Test that engine profiles apply their pragmas and reads don't block on writes."""
+        with TemporaryDirectory() as directory:
+            DB = _DB(f"sqlite:///{os.path.join(directory, 'db.sqlite3')}")
+            DB.create_tables()
+            reader, writer = DB.get_engine("read"), DB.get_engine("ingest")
+            assert reader is DB.engine and writer is not reader
+            with writer.connect() as connection:
+                assert connection.execute("PRAGMA journal_mode").scalar() == "wal"
+                assert connection.execute("PRAGMA cache_size").scalar() == engine_profiles["ingest"]["cache_size"]
+
+            with DB.get_session(profile="ingest") as session:
+                session.add(Season(year=2016))
+                session.flush()
+                with DB.get_session() as read_session:
+                    assert read_session.query(Season).count() == 0
+            with DB.get_session() as session:
+                assert session.query(Season).count() == 1
+
+            for engine in (reader, writer):
+                engine.dispose()
+        assert self.DB.get_engine("ingest") is self.DB.engine
+
+    def test_singleton_profile(self):
+        """>>> Test that a DB is shared per url and a conflicting default profile is rejected."""
+        assert _DB("sqlite:///:memory:") is self.DB and self.DB.profile == "read"
+        with self.assertRaises(ValueError):
+            _DB("sqlite:///:memory:", "ingest")
+        self.DB.configure("sqlite:///:memory:", "ingest")
+        try:
+            assert _DB("sqlite:///:memory:", "ingest") is self.DB
+        finally:
+            self.DB.configure("sqlite:///:memory:")
+
+    def test_writer(self):
+        """>>> Test that writes are serialised by the writer thread while readers proceed concurrently."""
+        with TemporaryDirectory() as directory:
+            DB = _DB(f"sqlite:///{os.path.join(directory, 'db.sqlite3')}")
+            DB.create_tables()
+            started, release = Event(), Event()
+
+            def slow_write(session):
+                session.add(Season(year=2016))
+                session.flush()
+                started.set()
+                release.wait(5)
+                return current_thread().name
+
+            def nested_write(session):
+                return DB.write(slow_write)
+
+            first = DB.write(slow_write)
+            second = DB.write(lambda session: session.add(Season(year=2017)))
+            assert started.wait(5)
+            with ThreadPoolExecutor(4) as pool:
+                counts = list(pool.map(lambda _: self.count_seasons(DB), range(8)))
+            assert counts == [0] * 8 and not second.done()
+            release.set()
+            assert first.result(5) == "db-writer" and second.result(5) is None
+            assert self.count_seasons(DB) == 2
+
+            self.assertRaises(RuntimeError, DB.write(nested_write).result, 5)
+            self.assertRaises(KeyError, DB.write(lambda session: (session.add(Season(year=2018)), {}["failure"])).result, 5)
+            assert self.count_seasons(DB) == 2
+
+            DB.writer.close()
+            for engine in (DB.get_engine("read"), DB.get_engine("ingest")):
+                engine.dispose()
+
+    @staticmethod
+    def count_seasons(DB):
+        with DB.read_session() as session:
+            return session.query(Season).count()
+
+    def add_matches(self):
+        with self.DB.get_session() as session:
+            teams = [Team(id=i, name=f"Team {i}") for i in range(6)]
+            for year in (2016, 2017):
+                season = Season(year=year, teams=teams)
+                for order_id in range(1, 4):
+                    group = Group(order_id=order_id, season=season)
+                    session.add_all(
+                        Match(date=datetime(year, 8, order_id), is_finished=True, group=group, host=host, guest=guest, host_points=1, guest_points=0)
+                        for host, guest in zip(teams[:3], teams[3:])
+                    )
+
+    def test_eager_loading(self):
+        """>>> Test that eagerly loaded match queries need a constant number of queries."""
+        self.add_matches()
+        queries = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            queries.append(statement)
+
+        event.listen(self.DB.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            # lazily every distinct host, guest, group and season is loaded on its own
+            for load, expected in ((None, 1 + 3 + 3 + 6 + 2), ("joined", 1), ("selectin", 3)):
+                queries.clear()
+                with self.DB.get_session() as session:
+                    matches = [str(match) for match in RangeSelector().build_match_query(load=load).with_session(session)]
+                assert len(matches) == 18
+                assert len(queries) == expected, (load, len(queries))
+        finally:
+            event.remove(self.DB.engine, "before_cursor_execute", before_cursor_execute)
+
+    def test_matchday_key(self):
+        """>>> Test that selections are a single range of maintained matchday keys."""
+        self.add_matches()
+        with self.DB.get_session() as session:
+            assert sorted(key for (key,) in session.query(Group.matchday_key)) == [201601, 201602, 201603, 201701, 201702, 201703]
+            group = session.query(Group).filter(Group.matchday_key == 201603).one()
+            group.season = session.query(Season).filter(Season.year == 2017).one()
+            group.order_id = 4
+        with self.DB.get_session() as session:
+            assert session.query(Group).filter(Group.matchday_key == 201704).count() == 1
+
+        selector = RangeSelector(RangePoint(2016, 2), RangePoint(2017))
+        assert str(selector.build_filters().compile(compile_kwargs={"literal_binds": True})) == "groups.matchday_key BETWEEN 201602 AND 201799"
+        assert str(RangeSelector(RangePoint(2016)).build_filters(ignore_groups=True).compile(compile_kwargs={"literal_binds": True})) == "seasons.year >= 2016"
+        with self.DB.get_session() as session:
+            assert selector.build_match_query().with_session(session).count() == 15
+            plan = " ".join(row[-1] for row in session.execute(
+                "EXPLAIN QUERY PLAN SELECT * FROM groups WHERE matchday_key BETWEEN 201602 AND 201799"
+            ))
+            assert "ix_groups_matchday_key" in plan
+
+    def test_load_match_frame(self):
+        """>>> Test loading the selected matches as integer coded columns."""
+        self.add_matches()
+        with self.DB.get_session() as session:
+            session.add(Match(date=datetime(2017, 9, 1), is_finished=False, group=session.query(Group).first()))
+            session.add(Team(id=6, name="Team 6"))
+
+        with self.DB.get_session() as session:
+            frame = load_match_frame(RangeSelector(RangePoint(2016, 2), RangePoint(2017, 1)), session)
+            assert len(frame) == 9 and len(frame.to_frame()) == 9
+            assert frame.teams == [f"Team {i}" for i in range(6)] and frame.team_ids.tolist() == list(range(6))
+            assert frame.host.tolist() == [0, 1, 2] * 3 and frame.guest.tolist() == [3, 4, 5] * 3
+            assert frame.season.tolist() == [2016] * 6 + [2017] * 3 and frame.group.tolist() == [2, 2, 2, 3, 3, 3, 1, 1, 1]
+            assert frame.date.dtype == "datetime64[s]" and frame.host_goals.sum() == 9
+
+            assert len(load_match_frame(RangeSelector(RangePoint(2018)), session)) == 0
+
+    def test_extend_match_frame(self):
+        """>>> Test that extending the frame of a previous selection equals loading the new selection."""
+        self.add_matches()
+        previous = RangeSelector(RangePoint(2016, 2), RangePoint(2017, 1))
+        with self.DB.get_session() as session:
+            frame = load_match_frame(previous, session)
+            # finished late on the last matchday of the previous selection
+            session.add(Match(
+                date=datetime(2017, 8, 20), is_finished=True, host_points=2, guest_points=2,
+                group=session.query(Group).filter(Group.matchday_key == 201701).one(),
+                host=session.query(Team).get(0), guest=session.query(Team).get(5),
+            ))
+
+        def rows(frame):
+            teams = np.array(frame.teams)
+            return sorted(zip(teams[frame.host], teams[frame.guest], frame.host_goals.tolist(), frame.date.tolist()))
+
+        with self.DB.get_session() as session:
+            for selector in (RangeSelector(RangePoint(2016, 3), RangePoint(2017, 3)), RangeSelector(RangePoint(2016, 2)), RangeSelector()):
+                extended, expected = extend_match_frame(frame, previous, selector, session), load_match_frame(selector, session)
+                assert rows(extended) == rows(expected) and extended.teams == expected.teams
+
+            # a result of a reused matchday corrected by a sync
+            match = session.query(Match).join(Match.group).filter(Group.matchday_key == 201603).first()
+            match.host_points = 3
+        with self.DB.get_session() as session:
+            selector = RangeSelector(RangePoint(2016, 3), RangePoint(2017, 3))
+            extended = extend_match_frame(frame, previous, selector, session)
+            assert rows(extended) == rows(load_match_frame(selector, session)) and 3 in extended.host_goals.tolist()
+
+    def test_query_cache(self):
+        """>>> Test that cached query results are reused until the data changes."""
+        self.add_matches()
+        selector = RangeSelector(RangePoint(2017))
+        with self.DB.get_session() as session:
+            generation = current_generation(session)
+            frame = load_match_frame(selector, session)
+            assert load_match_frame(RangeSelector(RangePoint(2017)), session) is frame
+            assert load_match_frame(RangeSelector(), session) is not frame
+            assert season_years(selector, session) == [2017]
+
+            # mutating the selector must not hit the entry of its former selection
+            selector.copy(RangeSelector())
+            assert season_years(selector, session) == [2016, 2017]
+
+        with self.DB.get_session() as session:
+            session.add(Season(year=2018))
+        with self.DB.get_session() as session:
+            assert current_generation(session) == generation + 1
+            assert season_years(RangeSelector(), session) == [2016, 2017, 2018]
+            assert load_match_frame(RangeSelector(RangePoint(2017)), session) is not frame
+
+        self.DB.drop_tables()
+        self.DB.create_tables()
+        with self.DB.get_session() as session:
+            assert season_years(RangeSelector(), session) == []
+        query_cache.clear()
@@ -1,10 +1,21 @@
+import pickle
 import unittest
 
+import numpy as np
+import pandas as pd
+import statsmodels.api as sm
+import statsmodels.formula.api as smf
+from scipy.stats import poisson
+from scipy.optimize import check_grad
+
 from ..db.core import _DB
 from ..db.selectors import RangeSelector, RangePoint
 from ..db.models import *  # noqa: 401
 from ..acquisition import download_matches
 from ..prediction import PoissonModel, DixonColesModel
+from ..prediction.dixoncoles import DixonColesLikelihood, apply_score_correction
+from ..prediction.base import collapse_rows
+from ..db.frames import MatchFrame
 
 
 class TestPrediction(unittest.TestCase):
@@ -39,3 +50,88 @@ class TestPrediction(unittest.TestCase):
         result_obj = model.make_prediction("FCB", "BVB")
 
         assert result_obj is not None, "Result didn't compute..."
+
+
+class TestDixonColesLikelihood(unittest.TestCase):
+    def setUp(self):
+        random = np.random.RandomState(0)
+        self.num_of_teams, self.num_of_matches = num_of_teams, num_of_matches = 6, 200
+        self.host, self.guest = random.randint(num_of_teams, size=num_of_matches), random.randint(num_of_teams, size=num_of_matches)
+        self.host_goals, self.guest_goals = random.poisson(1.5, num_of_matches), random.poisson(1.1, num_of_matches)
+        self.weights = random.uniform(0.5, 1, num_of_matches)
+        self.params = np.concatenate([random.normal(0, 0.2, 2 * num_of_teams), [0.05, 0.2]])
+        self.likelyhood = DixonColesLikelihood(self.host, self.guest, self.host_goals, self.guest_goals, self.weights, num_of_teams)
+
+    def test_likelyhood(self):
+        """>>> Test the array kernel of the Dixon-Coles likelihood against a per match evaluation."""
+        num_of_teams, num_of_matches, params = self.num_of_teams, self.num_of_matches, self.params
+        host, guest, host_goals, guest_goals, weights = self.host, self.guest, self.host_goals, self.guest_goals, self.weights
+        attack, defence = params[:num_of_teams], params[num_of_teams:-2]
+
+        expected = 0
+        for i in range(num_of_matches):
+            host_bias = np.exp(attack[host[i]] + defence[guest[i]] + params[-1])
+            guest_bias = np.exp(attack[guest[i]] + defence[host[i]])
+            expected += weights[i] * (
+                np.log(apply_score_correction(host_goals[i], guest_goals[i], host_bias, guest_bias, params[-2])) +  # noqa: W504
+                poisson.logpmf(host_goals[i], host_bias) + poisson.logpmf(guest_goals[i], guest_bias)
+            )
+
+        assert np.isclose(self.likelyhood(params), -expected)
+
+    def test_collapse_rows(self):
+        """>>> Test that collapsing identical matches into weighted ones keeps the likelihood."""
+        columns, weights = collapse_rows([self.host, self.guest, self.host_goals, self.guest_goals], self.weights)
+        assert len(weights) < self.num_of_matches and np.isclose(weights.sum(), self.weights.sum())
+        collapsed = DixonColesLikelihood(*columns, weights, self.num_of_teams)
+        assert np.isclose(collapsed(self.params), self.likelyhood(self.params))
+        assert np.allclose(collapsed.log_likelyhood_and_gradient(self.params)[1], self.likelyhood.log_likelyhood_and_gradient(self.params)[1])
+
+    def test_gradient(self):
+        """>>> Test the analytic gradient of the Dixon-Coles likelihood against finite differences."""
+        likelyhood = self.likelyhood
+        assert check_grad(likelyhood.log_likelyhood, lambda params: likelyhood.log_likelyhood_and_gradient(params)[1], self.params) < 1e-4
+
+        reduced = np.delete(self.params, self.num_of_teams - 1)
+        expanded = likelyhood.expand(reduced)
+        assert np.isclose(expanded[:self.num_of_teams].sum(), 0) and np.isclose(likelyhood.reduced(reduced)[0], likelyhood(expanded))
+        assert check_grad(lambda params: likelyhood.reduced(params)[0], lambda params: likelyhood.reduced(params)[1], reduced) < 1e-4
+
+
+class TestPoissonRegression(unittest.TestCase):
+    def test_coefficients(self):
+        """>>> Test that the sparse Poisson regression reproduces the coefficients of statsmodels."""
+        random = np.random.RandomState(0)
+        num_of_teams, num_of_matches = 8, 300
+        host = random.randint(num_of_teams, size=num_of_matches)
+        guest = (host + random.randint(1, num_of_teams, size=num_of_matches)) % num_of_teams
+        teams = [f"Team {name}" for name in "HCAGEBFD"]
+        frame = MatchFrame(
+            host=host, guest=guest, host_goals=random.poisson(1.5, num_of_matches), guest_goals=random.poisson(1.1, num_of_matches),
+            date=np.full(num_of_matches, np.datetime64("2016-08-26", "s")), season=np.full(num_of_matches, 2016), group=np.ones(num_of_matches, dtype=np.int64),
+            teams=teams, team_ids=np.arange(num_of_teams),
+        )
+        features, _ = PoissonModel.calculate_model(frame)
+
+        names = np.array(teams, dtype=object)
+        goal_model = pd.DataFrame({
+            "team": np.concatenate([names[host], names[guest]]),
+            "opponent": np.concatenate([names[guest], names[host]]),
+            "home": np.repeat([1, 0], num_of_matches),
+            "goals": np.concatenate([frame.host_goals, frame.guest_goals]),
+        })
+        expected = smf.glm(formula="goals ~ home + team + opponent", data=goal_model, family=sm.families.Poisson()).fit()
+        assert features.converged and set(features.params) == set(expected.params.index)
+        assert all(np.isclose(value, expected.params[name], atol=1e-10) for name, value in features.params.items())
+        assert np.isclose(features.expected_goals("Team A", "Team H", home=True), expected.predict(goal_model.iloc[[0]].assign(team="Team A", opponent="Team H", home=1)).iloc[0])
+
+        warm, _ = PoissonModel.calculate_model(frame, warm_start=features)
+        assert warm.iterations < features.iterations
+
+        # models pickled by earlier versions have the statsmodels results as features
+        model = PoissonModel.__new__(PoissonModel)
+        model.__setstate__({"selector": RangeSelector(), "features": expected, "teams": teams})
+        model = pickle.loads(pickle.dumps(model))
+        assert np.isclose(model.features.expected_goals("Team A", "Team H", home=True), features.expected_goals("Team A", "Team H", home=True))
+        with self.assertRaises(ValueError):
+            PoissonModel.__new__(PoissonModel).__setstate__({"selector": RangeSelector(), "features": object(), "teams": teams})
@@ -55,7 +55,7 @@ class DownloadFrame(ttk.LabelFrame):
         self._poll_list()
 
     def _update_years(self, event):
-        with DB.get_session() as session:
+        with DB.read_session() as session:
             years_to_download, _ = clean_download_list(session, range(2002, 2019))
         self._year_list.set_values([f"{year}/{(year % 100 + 1):0>2d}" for year in years_to_download])
 
@@ -73,18 +73,20 @@ class DownloadFrame(ttk.LabelFrame):
             return
         selected_years = [int(year[:4]) for year in selected_years]
 
-        try:
-            with DB.get_session() as session:
-                num_matches = len(selected_years) * 306
-                progress_increment = 100 / num_matches
+        def write_job(session):
+            num_matches = len(selected_years) * 306
+            progress_increment = 100 / num_matches
+
+            self._progressbar.set_label("starting download...")
+            for i, match in enumerate(download_matches(session, selected_years, batch_size=306)):
+                self._progressbar.step(progress_increment)
+                self._progressbar.set_label(f"{i + 1}/{num_matches}")
 
-                self._progressbar.set_label("starting download...")
-                for i, match in enumerate(download_matches(session, selected_years)):
-                    session.add(match)
-                    self._progressbar.step(progress_increment)
-                    self._progressbar.set_label(f"{i + 1}/{num_matches}")
+            self._progressbar.set_label("commiting changes...")
 
-                self._progressbar.set_label("commiting changes...")
+        try:
+            # the download is written by the single writer of the DB, it doesn't block any readers
+            DB.write(write_job).result()
         except:  # noqa: E722
             self._progressbar.set_label("something went wrong...")
             raise
@@ -118,7 +120,7 @@ class ModelCreateFrame(ttk.LabelFrame):
 
     def _training_job(self):
         def process_job(model_class, selector):
-            with DB.get_session() as session:
+            with DB.read_session() as session:
                 return model_class(selector, session)
 
         model_name = self._model_selectbox.selection
@@ -185,7 +187,10 @@ class ModelManageFrame(ttk.LabelFrame):
         )
         if file_name:
             with open(file_name, "rb") as fp:
-                AppData.models.data[os.path.basename(file_name)] = pickle.load(fp)
+                try:
+                    AppData.models.data[os.path.basename(file_name)] = pickle.load(fp)
+                except ValueError as e:
+                    tk.messagebox.showerror("Error", str(e))
 
     def _save_models(self, *args):
         file_name = filedialog.asksaveasfilename(
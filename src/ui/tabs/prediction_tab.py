@@ -7,7 +7,7 @@ from .base import Tab
 from ..data import AppData
 from ..jobs import ThreadJob, ProcessFuture
 from ..widgets import SelectBox, ScrollableList, RangePointSelectorWidget
-from ...db import DB, RangeSelector, Match, Group, Season
+from ...db import DB, RangeSelector, Match, Group, Season, season_years
 from ...acquisition import get_current_groups_matches
 
 
@@ -185,16 +185,14 @@ class QueuePopulateFrame(ttk.LabelFrame):
             )
 
     def _model_updated(self, *args):
-        with DB.get_session() as session:
+        with DB.read_session() as session:
             model = self.master._model_selection.selection
             if model is not None and model in AppData.models.data:
                 selector = AppData.models.data[model].selector
-                self._direct_selector.set_years([
-                    season.year for season in session.query(Season).filter(selector.build_filters(ignore_groups=True))
-                ])
+                self._direct_selector.set_years(season_years(selector, session))
 
     def _direct_selection_job(self):
-        with DB.get_session() as session:
+        with DB.read_session() as session:
             selection = self._direct_selector.selection
             model = self.master._model_selection.selection
 
@@ -208,5 +206,5 @@ class QueuePopulateFrame(ttk.LabelFrame):
                     for match in session.query(Match).join(Match.group, Group.season).filter(
                         Group.order_id == selection.group,
                         Season.year == selection.year
-                    )
+                    ).options(*RangeSelector.match_load_options("selectin"))
                 ))
@@ -21,7 +21,7 @@ class QueryList(ScrollableList):
         self.fill()
 
     def fill(self):
-        with DB.get_session() as session:
+        with DB.read_session() as session:
             self._data = OrderedDict([
                 (str(instance), getattr(instance, self._target_field))
                 for instance in (self._query() if callable(self._query) else self._query).with_session(session)
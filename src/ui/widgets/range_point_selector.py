@@ -2,9 +2,8 @@ import tkinter as tk
 import tkinter.ttk as ttk
 
 from .select_box import SelectBox
-from ...db.selectors import RangeSelector, RangePoint
+from ...db.selectors import RangeSelector, RangePoint, season_years
 from ...db import DB
-from ...db.models import Season
 
 
 __all__ = (
@@ -57,15 +56,14 @@ class RangePointSelectorWidget(ttk.LabelFrame):
             tk.messagebox.showerror("Error", e.args[0])
 
     def populate_years(self):
-        with DB.get_session() as session:
-            self.set_years([year for (year,) in session.query(Season.year).all()])
+        with DB.read_session() as session:
+            self.set_years(season_years(RangeSelector(), session))
 
     def populate_groups(self):
         self._group.set_options(["--", *map(str, range(1, 35))], set_val="--")
 
     def set_years(self, years):
-        years.sort()
-        self._year.set_options(["----", *years], set_val="----")
+        self._year.set_options(["----", *sorted(years)], set_val="----")
 
     @property
     def selection(self):